@@ -1,21 +1,41 @@
 from airflow import DAG, macros
-from airflow.operators.bash_operator import BashOperator
+from airflow.operators.python import PythonOperator
 from airflow.utils.dates import days_ago
 from datetime import datetime
 
+import dbt_sharding
+import dbt_state
+from dbt_operator import DbtRunOperator
+from parquet_export import ParquetExportOperator
+
 # Parse nodes
-import json
 JSON_MANIFEST_DBT = '/dbt/target/manifest.json'
 PARENT_MAP = 'parent_map'
 
+# Daily models that can be counted in hash shards before the dbt run (see dbt_sharding.py)
+SHARDED_MODELS = {'daily_orders'}
+
+# Models exported to Parquet after they are built, for the Streamlit app (see parquet_export.py)
+PARQUET_EXPORTS = {
+    'top_selling_products': {},
+    'top_selling_aisles': {},
+    'top_selling_departments': {},
+    'avg_product_count_by_dow': {},
+    'daily_orders_7_day_avg': {
+        'partition_by': "to_char(dt, 'YYYY-MM')",
+        'partition_name': 'month',
+        # Re-export the months touched by this run only
+        'where': "dt >= date_trunc('month', '{{ yesterday_ds }}'::date)",
+    },
+}
+
 def sanitise_node_names(value):
         segments = value.split('.')
         if (segments[0] == 'model'):
                 return value.split('.')[-1]
 
 def get_node_structure():
-    with open(JSON_MANIFEST_DBT) as json_data:
-        data = json.load(json_data)
+    data = dbt_state.load_manifest(JSON_MANIFEST_DBT)
     ancestors_data = data[PARENT_MAP]
     tree = {}
     for node in ancestors_data:
@@ -30,6 +50,8 @@ def get_node_structure():
                     tree[clean_node_name] = {}
                     tree[clean_node_name]['ancestors'] = ancestors_2
                     tree[clean_node_name]['tags'] = data['nodes'][node]['tags']
+                    tree[clean_node_name]['materialized'] = data['nodes'][node]['config']['materialized']
+                    tree[clean_node_name]['meta'] = data['nodes'][node]['config'].get('meta', {})
     
     return tree
 
@@ -76,31 +98,59 @@ for node in nodes:
     if ('daily' in nodes[node]['tags']):
         date_end = "{{ ds }}"
         date_start = "{{ yesterday_ds }}"
-        bsh_cmd = 'cd /dbt && dbt run --models {nodeName} --vars \'{{"start_date":"{start_date}", "end_date":"{end_date}"}}\' '.format(nodeName = node, start_date = date_start, end_date = date_end)
-        tmp_operator = BashOperator(
-            task_id= node,
-            bash_command=bsh_cmd,
-            dag=daily_dag,
-            depends_on_past = True
-        )
+        if node in SHARDED_MODELS:
+            # The plan task returns no shards unless DBT_DAILY_SHARDS or {"daily_shards": N} is above 1
+            plan_operator = PythonOperator(
+                task_id='plan_'+node+'_shards',
+                python_callable=dbt_sharding.plan_shards,
+                op_kwargs={'ds': date_end},
+                dag=daily_dag,
+            )
+            shard_operator = PythonOperator.partial(
+                task_id=node+'_shard',
+                python_callable=dbt_sharding.run_shard,
+                op_kwargs={'ds': date_end, 'start_date': date_start, 'end_date': date_end},
+                dag=daily_dag,
+            ).expand(op_args=plan_operator.output)
+            tmp_operator = DbtRunOperator(
+                task_id= node,
+                model=node,
+                dbt_vars={'start_date': date_start, 'end_date': date_end,
+                          'sharded': "{{ ti.xcom_pull(task_ids='plan_"+node+"_shards') | length > 0 }}"},
+                dag=daily_dag,
+                depends_on_past = True,
+                # Shard tasks are skipped when sharding is disabled
+                trigger_rule='none_failed',
+            )
+            plan_operator >> shard_operator >> tmp_operator
+        else:
+            tmp_operator = DbtRunOperator(
+                task_id= node,
+                model=node,
+                dbt_vars={'start_date': date_start, 'end_date': date_end},
+                dag=daily_dag,
+                depends_on_past = True
+            )
         all_operators[node] = tmp_operator
 
     elif ('snapshot' in nodes[node]['tags']):
-        bsh_cmd = 'cd /dbt && dbt run --models {nodeName} '.format(nodeName = node)
-        tmp_operator = BashOperator(
+        tmp_operator = DbtRunOperator(
             task_id= node,
-            bash_command=bsh_cmd,
+            model=node,
+            skip_unchanged=True,
+            result_cache=(nodes[node]['materialized'] == 'table'),
+            cache_snapshots=nodes[node]['meta'].get('cache_snapshots', False),
+            trigger_rule='none_failed',
             dag=snapshot_dag,
         )
         all_operators[node] = tmp_operator
 
     elif ('init-once' in nodes[node]['tags']):
-        date_end = "{{ ds }}"
-        date_start = "{{ yesterday_ds }}"
-        bsh_cmd = 'cd /dbt && dbt run --models {nodeName} '.format(nodeName = node)
-        tmp_operator = BashOperator(
+        tmp_operator = DbtRunOperator(
             task_id= node,
-            bash_command=bsh_cmd,
+            model=node,
+            skip_unchanged=True,
+            trigger_rule='none_failed',
             dag=init_once_dag,
         )
         all_operators[node] = tmp_operator
@@ -109,4 +159,16 @@ for node in nodes:
 for node in nodes:
     for parent in nodes[node]['ancestors']:
         if nodes[node]['tags'] == nodes[parent]['tags']:
-            all_operators[parent] >> all_operators[node]
\ No newline at end of file
+            all_operators[parent] >> all_operators[node]
+
+# Export the models once they are built. Unchanged (skipped) models are not exported again.
+for node, export_args in PARQUET_EXPORTS.items():
+    if node in all_operators:
+        export_operator = ParquetExportOperator(
+            task_id='export_'+node,
+            model=node,
+            trigger_rule='none_failed',
+            dag=all_operators[node].dag,
+            **export_args
+        )
+        all_operators[node] >> export_operator
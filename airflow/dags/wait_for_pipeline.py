@@ -0,0 +1,39 @@
+import logging
+from datetime import datetime
+
+from airflow import DAG
+from airflow.operators.python import PythonOperator
+
+from audit_event_sensor import AuditEventSensor
+
+log = logging.getLogger(__name__)
+
+
+def report_end_event(ti):
+    """Log the end audit event found by the sensor and return it as this task's XCom."""
+    event = ti.xcom_pull(task_ids='wait_for_end_event')
+    log.info(f'Pipeline finished: {event}')
+    return event
+
+
+# Trigger with {"correlation_id": "corr-..."} to wait for the end of that data_engineering_pipeline run.
+# The sensor defers to the triggerer, so the wait does not hold a worker slot.
+with DAG(
+    'wait_for_pipeline',
+    start_date=datetime(2019, 1, 1),
+    schedule_interval=None,
+    catchup=False,
+    max_active_runs=32,
+) as dag:
+    wait_for_end = AuditEventSensor(
+        task_id='wait_for_end_event',
+        correlation_id='{{ dag_run.conf["correlation_id"] }}',
+        timeout=6 * 60 * 60,
+    )
+
+    report = PythonOperator(
+        task_id='report',
+        python_callable=report_end_event,
+    )
+
+    wait_for_end >> report
@@ -0,0 +1,197 @@
+"""Deferrable sensor that waits for an audit event of a pipeline run.
+
+The audit-service publishes every recorded event to the Dapr `pubsub`
+component, topic `audit-events`. The Redis pub/sub component stores a topic as
+a Redis stream of the same name, one entry per event with the CloudEvent
+envelope in its `data` field.
+
+AuditEventSensor defers to AuditEventTrigger, which waits in the triggerer:
+it first searches the whole stream, newest entries first and PAGE_SIZE at a
+time, in case the event was published before the sensor started. The stream
+is capped (maxLenApprox in pubsub.yaml), so this is bounded. It then blocks on
+XREAD for entries newer than the newest one searched. While it waits the task
+holds no worker slot.
+"""
+import json
+import os
+from datetime import timedelta
+
+import redis
+from airflow.exceptions import AirflowException
+from airflow.sensors.base import BaseSensorOperator
+from airflow.triggers.base import BaseTrigger, TriggerEvent
+from redis import asyncio as aioredis
+
+REDIS_URL = os.environ.get('AUDIT_EVENTS_REDIS_URL', 'redis://redis:6379/0')
+STREAM = 'audit-events'
+PAGE_SIZE = 1000  # stream entries read per XREVRANGE while searching past events
+BLOCK_MS = 5000
+
+
+def parse_entry(fields):
+    """Return the audit event of a stream entry, unwrapping the CloudEvent envelope."""
+    raw = fields.get(b'data', fields.get('data'))
+    if raw is None:
+        return None
+    try:
+        payload = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(payload, dict) and 'specversion' in payload:
+        payload = payload.get('data')
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except ValueError:
+                return None
+    return payload if isinstance(payload, dict) else None
+
+
+def event_matches(event, correlation_id, status='end'):
+    return bool(event) and event.get('correlationId') == correlation_id and event.get('status') == status
+
+
+def find_event(entries, correlation_id, status='end'):
+    for _, fields in entries:
+        event = parse_entry(fields)
+        if event_matches(event, correlation_id, status):
+            return event
+    return None
+
+
+def entry_id(entry):
+    value = entry[0]
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def search_stream(client, stream, correlation_id, status='end', page_size=PAGE_SIZE):
+    """Search the whole stream, newest first. Returns (event or None, id of the newest entry or None)."""
+    newest = None
+    upper = '+'
+    while True:
+        entries = client.xrevrange(stream, max=upper, count=page_size)
+        if entries and newest is None:
+            newest = entry_id(entries[0])
+        event = find_event(entries, correlation_id, status)
+        if event is not None or len(entries) < page_size:
+            return event, newest
+        # Exclusive bound: continue below the oldest entry of this page
+        upper = f'({entry_id(entries[-1])}'
+
+
+async def asearch_stream(client, stream, correlation_id, status='end', page_size=PAGE_SIZE):
+    """search_stream for redis.asyncio clients."""
+    newest = None
+    upper = '+'
+    while True:
+        entries = await client.xrevrange(stream, max=upper, count=page_size)
+        if entries and newest is None:
+            newest = entry_id(entries[0])
+        event = find_event(entries, correlation_id, status)
+        if event is not None or len(entries) < page_size:
+            return event, newest
+        upper = f'({entry_id(entries[-1])}'
+
+
+class AuditEventTrigger(BaseTrigger):
+    """Fire once the audit event with this correlation id and status is on the stream."""
+
+    def __init__(self, correlation_id, status='end', redis_url=REDIS_URL, stream=STREAM,
+                 page_size=PAGE_SIZE, block_ms=BLOCK_MS):
+        super().__init__()
+        self.correlation_id = correlation_id
+        self.status = status
+        self.redis_url = redis_url
+        self.stream = stream
+        self.page_size = page_size
+        self.block_ms = block_ms
+
+    def serialize(self):
+        return ('audit_event_sensor.AuditEventTrigger', {
+            'correlation_id': self.correlation_id,
+            'status': self.status,
+            'redis_url': self.redis_url,
+            'stream': self.stream,
+            'page_size': self.page_size,
+            'block_ms': self.block_ms,
+        })
+
+    def get_client(self):
+        return aioredis.from_url(self.redis_url)
+
+    async def run(self):
+        client = self.get_client()
+        try:
+            event, newest = await asearch_stream(client, self.stream, self.correlation_id, self.status, self.page_size)
+            if event is not None:
+                yield TriggerEvent({'status': 'success', 'event': event})
+                return
+            # Continue right after the newest entry searched, or from the start of an empty stream
+            last_id = newest or '0-0'
+            self.log.info(f'Waiting for the {self.status} event of {self.correlation_id} on {self.stream}')
+            while True:
+                response = await client.xread({self.stream: last_id}, count=100, block=self.block_ms)
+                for _, messages in response or []:
+                    if not messages:
+                        continue
+                    last_id = messages[-1][0]
+                    event = find_event(messages, self.correlation_id, self.status)
+                    if event is not None:
+                        yield TriggerEvent({'status': 'success', 'event': event})
+                        return
+        except Exception as e:
+            yield TriggerEvent({'status': 'error', 'message': f'{type(e).__name__}: {e}'})
+        finally:
+            await client.aclose()
+
+
+class AuditEventSensor(BaseSensorOperator):
+    """Wait for the audit event (by default `end`) of the pipeline run with this correlation id.
+
+    With deferrable=True (the default) the wait happens in the triggerer. The
+    event is returned, and pushed as XCom. With fail_on_failed_result, an end
+    event whose result is `failed` fails the task.
+    """
+    template_fields = ('correlation_id',)
+    ui_color = '#7fb3d5'
+
+    def __init__(self, correlation_id, status='end', redis_url=REDIS_URL, stream=STREAM,
+                 page_size=PAGE_SIZE, deferrable=True, fail_on_failed_result=True, **kwargs):
+        super().__init__(**kwargs)
+        self.correlation_id = correlation_id
+        self.status = status
+        self.redis_url = redis_url
+        self.stream = stream
+        self.page_size = page_size
+        self.deferrable = deferrable
+        self.fail_on_failed_result = fail_on_failed_result
+        self.event = None
+
+    def execute(self, context):
+        if not self.deferrable:
+            super().execute(context)
+            return self.check_result(self.event)
+        self.defer(
+            trigger=AuditEventTrigger(self.correlation_id, self.status, self.redis_url, self.stream, self.page_size),
+            method_name='execute_complete',
+            timeout=timedelta(seconds=self.timeout),
+        )
+
+    def poke(self, context):
+        client = redis.Redis.from_url(self.redis_url)
+        try:
+            self.event, _ = search_stream(client, self.stream, self.correlation_id, self.status, self.page_size)
+        finally:
+            client.close()
+        return self.event is not None
+
+    def execute_complete(self, context, event):
+        if event['status'] == 'error':
+            raise AirflowException(f'Failed to read {self.stream}: {event["message"]}')
+        return self.check_result(event['event'])
+
+    def check_result(self, event):
+        self.log.info(f'Received the {self.status} event of {self.correlation_id}: {event}')
+        if self.fail_on_failed_result and event.get('result') == 'failed':
+            raise AirflowException(f'Pipeline run {self.correlation_id} failed: {event.get("error")}')
+        return event
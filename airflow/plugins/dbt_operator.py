@@ -0,0 +1,211 @@
+import json
+import time
+from contextlib import closing
+from datetime import timedelta
+
+from airflow.exceptions import AirflowException, AirflowSkipException
+from airflow.hooks.subprocess import SubprocessHook
+from airflow.models import BaseOperator
+from airflow.providers.postgres.hooks.postgres import PostgresHook
+from airflow.stats import Stats
+
+import dbt_result_cache
+import dbt_state
+import dbt_runner_pool
+from dbt_runner_pool import DEFAULT_ADDRESS, DEFAULT_TIMEOUT, DbtRunnerPoolTimeout, DbtRunnerPoolUnavailable
+
+
+class DbtRunOperator(BaseOperator):
+    """Run a single dbt model.
+
+    The run is sent to the warm dbt runner pool (see dbt_runner_pool.py). When
+    the pool is disabled, cannot be reached or goes away mid-run, the dbt CLI
+    is run in a subprocess instead, as the DAGs used to do with BashOperator.
+    A pool run that takes longer than pool_timeout is cancelled and fails the
+    task.
+
+    With skip_unchanged, the task is skipped when the model SQL, its upstream
+    sources and its parent models are all unchanged since the last successful
+    build (see dbt_state.py).
+
+    With result_cache, the model is looked up in the content-addressed result
+    cache instead (see dbt_result_cache.py): on a hit the relation is left
+    as-is, or restored from a cached snapshot when cache_snapshots is set, and
+    the task succeeds without running dbt. Hits, misses and the saved run time
+    are reported as dbt_result_cache.* metrics and the `cache_hit` XCom.
+
+    Either way, a reproducible build records its input key as its build id,
+    so that children rebuilt from identical inputs get identical keys.
+
+    Trigger the DAG with {"force_rebuild": true} to rebuild regardless.
+    """
+    template_fields = ('dbt_vars',)
+    ui_color = '#ff694b'
+
+    def __init__(self, model, dbt_vars=None, project_dir='/dbt', use_pool=True,
+                 pool_address=DEFAULT_ADDRESS, pool_timeout=DEFAULT_TIMEOUT, skip_unchanged=False,
+                 result_cache=False, cache_snapshots=False,
+                 postgres_conn_id='dbt_postgres_instance_raw_data',
+                 manifest_path=dbt_state.JSON_MANIFEST_DBT, state_dir=dbt_state.STATE_DIR,
+                 *args, **kwargs):
+        super(DbtRunOperator, self).__init__(*args, **kwargs)
+        self.model = model
+        self.dbt_vars = dbt_vars
+        self.project_dir = project_dir
+        self.use_pool = use_pool
+        self.pool_address = pool_address
+        self.pool_timeout = pool_timeout
+        self.skip_unchanged = skip_unchanged
+        self.result_cache = result_cache
+        self.cache_snapshots = cache_snapshots
+        self.postgres_conn_id = postgres_conn_id
+        self.manifest_path = manifest_path
+        self.state_dir = state_dir
+        self.subprocess_hook = None
+        self.pool_connection = None
+
+    def dbt_args(self):
+        args = ['run', '--models', self.model]
+        if self.dbt_vars:
+            args += ['--vars', json.dumps(self.dbt_vars)]
+        return args
+
+    def execute(self, context):
+        manifest = dbt_state.load_manifest(self.manifest_path)
+        unique_id, node = dbt_state.model_node(manifest, self.model)
+        if node is None:
+            raise AirflowException(f'Model {self.model} not found in {self.manifest_path}')
+        node = dbt_state.with_file_checksum(node, self.project_dir)
+        parent_names = dbt_state.parent_models(manifest, unique_id)
+        parents = dbt_state.parent_builds(parent_names, self.state_dir)
+        previous = dbt_state.read_state(self.model, self.state_dir)
+        forced = self.force_rebuild(context)
+        sources = {}
+        exists = False
+        key = None
+        reproducible = False
+
+        if self.skip_unchanged or self.result_cache:
+            relations = dbt_state.source_relations(manifest, unique_id)
+            with closing(self.get_conn()) as conn, conn.cursor() as cursor:
+                sources = dbt_state.relation_fingerprints(cursor, relations)
+                exists = dbt_state.relation_exists(cursor, node['schema'], node['alias'])
+            key = dbt_result_cache.cache_key(dbt_result_cache.model_sql(node), sources, parents,
+                                             checksum=node['checksum']['checksum'], dbt_vars=self.dbt_vars)
+            reproducible = (node.get('config', {}).get('meta', {}).get('reproducible', True)
+                            and dbt_result_cache.content_addressed(sources)
+                            and dbt_state.parents_reproducible(parent_names, self.state_dir))
+
+        if self.result_cache:
+            if not forced:
+                hit = self.lookup_cache(node, key, previous, exists, sources, parents, reproducible)
+                if hit is not None:
+                    context['ti'].xcom_push(key='cache_hit', value=True)
+                    return hit
+            context['ti'].xcom_push(key='cache_hit', value=False)
+            Stats.incr('dbt_result_cache.miss')
+            Stats.incr(f'dbt_result_cache.miss.{self.model}')
+        elif self.skip_unchanged:
+            reasons = dbt_state.change_reasons(node, previous, sources, parents)
+            if not exists:
+                reasons.append(f'relation {node["schema"]}.{node["alias"]} does not exist')
+            if forced:
+                reasons.append('rebuild forced by the DAG run configuration')
+            if not reasons:
+                raise AirflowSkipException(
+                    f'{self.model} is unchanged since its last successful build at {previous["built_at"]}')
+            self.log.info(f'Rebuilding {self.model}: {"; ".join(reasons)}')
+
+        started = time.monotonic()
+        result = self.run_dbt(self.dbt_args())
+        duration = time.monotonic() - started
+        state = dbt_state.new_state(self.model, node, sources, parents, duration,
+                                    build_id=key if reproducible else None)
+        state['reproducible'] = reproducible
+        if self.result_cache:
+            state['cache_key'] = key
+        dbt_state.write_state(self.model, state, self.state_dir)
+
+        # A snapshot under a key that can never come back would only be dead weight
+        if self.result_cache and self.cache_snapshots and reproducible:
+            with closing(self.get_conn()) as conn, conn.cursor() as cursor:
+                dbt_result_cache.save_snapshot(cursor, self.model, key, node['schema'], node['alias'], duration)
+                conn.commit()
+        return result
+
+    def lookup_cache(self, node, key, previous, exists, sources, parents, reproducible):
+        """Serve the model from the result cache. Returns None on a miss."""
+        if exists and previous and previous.get('cache_key') == key:
+            saved = previous['duration']
+            self.log.info(f'Cache hit for {self.model} ({key[:16]}): relation left as-is')
+        elif self.cache_snapshots and reproducible:
+            with closing(self.get_conn()) as conn, conn.cursor() as cursor:
+                snapshot = dbt_result_cache.find_snapshot(cursor, self.model, key)
+                if snapshot is None:
+                    return None
+                table, saved = snapshot
+                if not dbt_result_cache.restore_snapshot(cursor, table, node['schema'], node['alias']):
+                    self.log.info(f'Snapshot {dbt_result_cache.CACHE_SCHEMA}.{table} no longer matches the columns '
+                                  f'of {node["schema"]}.{node["alias"]}')
+                    return None
+                conn.commit()
+            state = dbt_state.new_state(self.model, node, sources, parents, saved, build_id=key)
+            state['reproducible'] = True
+            state['cache_key'] = key
+            dbt_state.write_state(self.model, state, self.state_dir)
+            self.log.info(f'Cache hit for {self.model} ({key[:16]}): restored from {dbt_result_cache.CACHE_SCHEMA}.{table}')
+        else:
+            return None
+
+        saved = saved or 0.0
+        Stats.incr('dbt_result_cache.hit')
+        Stats.incr(f'dbt_result_cache.hit.{self.model}')
+        Stats.timing('dbt_result_cache.saved_time', timedelta(seconds=saved))
+        Stats.timing(f'dbt_result_cache.saved_time.{self.model}', timedelta(seconds=saved))
+        self.log.info(f'Saved about {saved:.1f}s of dbt run time')
+        return {'cache_hit': True, 'cache_key': key, 'saved_seconds': saved}
+
+    def get_conn(self):
+        return PostgresHook(postgres_conn_id=self.postgres_conn_id).get_conn()
+
+    @staticmethod
+    def force_rebuild(context):
+        dag_run = context.get('dag_run')
+        return bool(dag_run and dag_run.conf and dag_run.conf.get('force_rebuild'))
+
+    def run_dbt(self, args):
+        if self.use_pool:
+            try:
+                return self.run_in_pool(args)
+            except DbtRunnerPoolUnavailable as e:
+                self.log.warning(f'{e}. Falling back to the dbt CLI.')
+        return self.run_subprocess(args)
+
+    def run_in_pool(self, args):
+        self.log.info(f'Running dbt {" ".join(args)} in the dbt runner pool')
+        self.pool_connection = dbt_runner_pool.connect(self.pool_address)
+        try:
+            response = dbt_runner_pool.run_in_pool(args, address=self.pool_address, timeout=self.pool_timeout,
+                                                   connection=self.pool_connection)
+        except DbtRunnerPoolTimeout as e:
+            raise AirflowException(f'dbt run of {self.model} failed: {e}') from e
+        finally:
+            self.pool_connection = None
+        for line in response['log']:
+            self.log.info(line)
+        if not response['success']:
+            raise AirflowException(f'dbt run of {self.model} failed: {response["error"]}')
+        return response['results']
+
+    def run_subprocess(self, args):
+        self.subprocess_hook = SubprocessHook()
+        result = self.subprocess_hook.run_command(command=['dbt'] + args, cwd=self.project_dir)
+        if result.exit_code != 0:
+            raise AirflowException(f'dbt run of {self.model} failed with exit code {result.exit_code}')
+        return None
+
+    def on_kill(self):
+        if self.pool_connection:
+            dbt_runner_pool.cancel(self.pool_connection)
+        if self.subprocess_hook:
+            self.subprocess_hook.send_sigterm()
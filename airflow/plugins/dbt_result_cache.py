@@ -0,0 +1,134 @@
+"""Content-addressed result cache for table-materialized dbt models.
+
+A model's cache key is the hash of its SQL as it is on disk (raw, not
+compiled: the compiled files in target/ are those of the previous run), its
+file checksum and dbt vars, plus the content of every relation it reads:
+
+* a raw table loaded by 1_load_initial_data is identified by the sha256 of the
+  file it was loaded from (dbt_raw_data._load_state, see raw_data_loader.py),
+* any other source by its row count and newest xmin (see dbt_state.py), which
+  a reload changes even when the rows are identical,
+* a parent model by its build id. DbtRunOperator uses the input key as the
+  build id of the models it tracks, so identical inputs propagate identical
+  keys down the graph.
+
+If the key matches the last build, the relation is left as-is. A key is
+reproducible when all of it is content: no xmin fingerprint, and no parent
+or model marked `meta={'reproducible': false}` (e.g. SQL using random()).
+For reproducible keys, a copy of each build can be kept in the dbt_cache
+schema (the most recent SNAPSHOTS_PER_MODEL per model), so a model whose
+inputs return to an earlier state is restored without re-running its SQL.
+"""
+import hashlib
+import json
+
+from psycopg2 import sql
+
+CACHE_SCHEMA = 'dbt_cache'
+SNAPSHOTS_PER_MODEL = 3
+
+REGISTRY_DDL = """
+    create table if not exists {schema}.snapshots (
+        model text not null,
+        cache_key text not null,
+        table_name text not null,
+        duration double precision,
+        created_at timestamp not null default now(),
+        primary key (model, cache_key)
+    )
+"""
+
+
+def model_sql(node):
+    """Return the raw SQL of a node."""
+    return node.get('raw_code') or node.get('raw_sql', '')
+
+
+def content_addressed(contents):
+    """True if every source is identified by the checksum of its loaded file."""
+    return all(isinstance(content, dict) for content in contents.values())
+
+
+def cache_key(code, sources, parents, checksum=None, dbt_vars=None):
+    """Hash the model SQL together with the fingerprints of its upstream relations."""
+    payload = json.dumps({'sql': code, 'checksum': checksum, 'vars': dbt_vars,
+                          'sources': sources, 'parents': parents}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def snapshot_table(model, key):
+    return f'{model}__{key[:16]}'
+
+
+def ensure_registry(cursor):
+    cursor.execute(sql.SQL('create schema if not exists {}').format(sql.Identifier(CACHE_SCHEMA)))
+    cursor.execute(sql.SQL(REGISTRY_DDL).format(schema=sql.Identifier(CACHE_SCHEMA)))
+
+
+def find_snapshot(cursor, model, key):
+    """Return (table_name, build_duration) of the snapshot for this key, or None."""
+    ensure_registry(cursor)
+    cursor.execute(
+        sql.SQL('select table_name, duration from {}.snapshots where model = %s and cache_key = %s')
+        .format(sql.Identifier(CACHE_SCHEMA)), (model, key))
+    row = cursor.fetchone()
+    if row and _table_exists(cursor, row[0]):
+        return row[0], row[1]
+    return None
+
+
+def _table_exists(cursor, table):
+    cursor.execute('select to_regclass(%s) is not null', (f'{CACHE_SCHEMA}."{table}"',))
+    return cursor.fetchone()[0]
+
+
+def save_snapshot(cursor, model, key, schema, alias, duration, keep=SNAPSHOTS_PER_MODEL):
+    """Copy the freshly built relation into the cache and drop the oldest snapshots beyond `keep`."""
+    ensure_registry(cursor)
+    table = snapshot_table(model, key)
+    cursor.execute(sql.SQL('drop table if exists {}.{}').format(sql.Identifier(CACHE_SCHEMA), sql.Identifier(table)))
+    cursor.execute(sql.SQL('create table {}.{} as table {}.{}').format(
+        sql.Identifier(CACHE_SCHEMA), sql.Identifier(table), sql.Identifier(schema), sql.Identifier(alias)))
+    cursor.execute(
+        sql.SQL('insert into {}.snapshots (model, cache_key, table_name, duration) values (%s, %s, %s, %s) '
+                'on conflict (model, cache_key) do update set duration = excluded.duration, created_at = now()')
+        .format(sql.Identifier(CACHE_SCHEMA)), (model, key, table, duration))
+
+    cursor.execute(
+        sql.SQL('select cache_key, table_name from {}.snapshots where model = %s order by created_at desc offset %s')
+        .format(sql.Identifier(CACHE_SCHEMA)), (model, keep))
+    for old_key, old_table in cursor.fetchall():
+        cursor.execute(sql.SQL('drop table if exists {}.{}').format(
+            sql.Identifier(CACHE_SCHEMA), sql.Identifier(old_table)))
+        cursor.execute(sql.SQL('delete from {}.snapshots where model = %s and cache_key = %s')
+                       .format(sql.Identifier(CACHE_SCHEMA)), (model, old_key))
+
+
+def _columns(cursor, schema, table):
+    """Return [(name, type)] of a table's columns, empty if it does not exist."""
+    cursor.execute(
+        "select attname, format_type(atttypid, atttypmod) from pg_attribute "
+        "where attrelid = to_regclass(format('%%I.%%I', %s, %s)) and attnum > 0 and not attisdropped "
+        "order by attnum", (schema, table))
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def restore_snapshot(cursor, table, schema, alias):
+    """Replace the model relation with a cached snapshot, within the caller's transaction.
+
+    An existing relation is truncated and refilled rather than dropped, so its
+    indexes, grants, comments and dependent views are kept. If its columns
+    differ from the snapshot's, nothing is changed and False is returned: the
+    model has to be rebuilt by dbt.
+    """
+    target = sql.SQL('{}.{}').format(sql.Identifier(schema), sql.Identifier(alias))
+    snapshot = sql.SQL('{}.{}').format(sql.Identifier(CACHE_SCHEMA), sql.Identifier(table))
+    columns = _columns(cursor, schema, alias)
+    if not columns:
+        cursor.execute(sql.SQL('create table {} as table {}').format(target, snapshot))
+        return True
+    if columns != _columns(cursor, CACHE_SCHEMA, table):
+        return False
+    cursor.execute(sql.SQL('truncate {}').format(target))
+    cursor.execute(sql.SQL('insert into {} table {}').format(target, snapshot))
+    return True
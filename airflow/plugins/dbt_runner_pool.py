@@ -0,0 +1,336 @@
+"""Pool of warm dbt worker processes.
+
+Every worker imports dbt and the postgres adapter once and keeps the parsed
+project manifest in memory, so a task only pays for the SQL it runs instead of
+a Python cold start plus a full project parse. The project is re-parsed when a
+model, schema or project file changes.
+
+The server is started next to the scheduler (see scripts/init.sh) and listens
+on DBT_RUNNER_POOL_ADDRESS. DbtRunOperator sends it the dbt command line and
+falls back to running the dbt CLI when the pool cannot be reached.
+
+Each worker serves one invocation at a time over its own pipe. While it runs,
+the server watches the client connection: when the client cancels, times out
+or goes away, the worker is killed and replaced. A worker that dies mid-run is
+replaced too, and the client gets a failed response instead of waiting forever.
+
+    python /airflow/plugins/dbt_runner_pool.py --workers 4
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = os.environ.get('DBT_RUNNER_POOL_ADDRESS', '/tmp/dbt-runner-pool.sock')
+DEFAULT_AUTHKEY = os.environ.get('DBT_RUNNER_POOL_AUTHKEY', 'dbt-runner-pool').encode()
+DEFAULT_WORKERS = int(os.environ.get('DBT_RUNNER_POOL_WORKERS', 4))
+# Longest a client waits for a run before giving up (and cancelling it)
+DEFAULT_TIMEOUT = float(os.environ.get('DBT_RUNNER_POOL_TIMEOUT', 3600))
+PROJECT_DIR = os.environ.get('DBT_PROJECT_DIR', '/dbt')
+PROJECT_FILES = ('dbt_project.yml', 'profiles.yml', 'packages.yml')
+PROJECT_SUBDIRS = ('models', 'macros', 'snapshots', 'data', 'seeds', 'analysis')
+
+# Restart a worker after this many invocations to cap memory growth
+MAX_INVOCATIONS_PER_WORKER = 200
+# How often a busy server thread checks its client and its worker
+POLL_INTERVAL = 0.5
+# Workers are forked from a clean server process, so that they do not inherit
+# the client sockets and the listener of the (threaded) pool server
+MP_CONTEXT = multiprocessing.get_context('forkserver')
+
+
+class DbtRunnerPoolUnavailable(Exception):
+    """The pool server could not be reached, or closed the connection before answering."""
+
+
+class DbtRunnerPoolTimeout(TimeoutError):
+    """The pool did not answer in time. The run was cancelled."""
+
+
+# Per-process state of a worker, populated by _init_worker
+_worker = {}
+
+
+def project_fingerprint(project_dir):
+    """Return a value that changes whenever a file dbt parses is modified."""
+    entries = []
+    for name in PROJECT_FILES:
+        path = os.path.join(project_dir, name)
+        if os.path.exists(path):
+            entries.append((path, os.stat(path).st_mtime_ns))
+    for subdir in PROJECT_SUBDIRS:
+        for root, _, files in os.walk(os.path.join(project_dir, subdir)):
+            for name in files:
+                path = os.path.join(root, name)
+                entries.append((path, os.stat(path).st_mtime_ns))
+    return hash(tuple(sorted(entries)))
+
+
+def _on_event(event):
+    if event.info.level in ('info', 'warn', 'error'):
+        _worker['log'].append(event.info.msg)
+
+
+def write_manifest(manifest, path):
+    """Publish a parsed manifest atomically, so that readers of manifest.json never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.manifest.', suffix='.json')
+    os.close(fd)
+    try:
+        manifest.write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _load_project():
+    from dbt.cli.main import dbtRunner
+
+    # dbt would rewrite target/manifest.json in place while tasks and DAG files read it
+    result = dbtRunner().invoke(['--no-write-json', 'parse'])
+    if not result.success:
+        raise RuntimeError(f'dbt parse failed: {result.exception}')
+    write_manifest(result.result, os.path.join(_worker['project_dir'], 'target', 'manifest.json'))
+    _worker['runner'] = dbtRunner(manifest=result.result, callbacks=[_on_event])
+    _worker['fingerprint'] = project_fingerprint(_worker['project_dir'])
+    logger.info(f'Worker {os.getpid()} loaded the dbt project')
+
+
+def _init_worker(project_dir):
+    os.chdir(project_dir)
+    _worker['project_dir'] = project_dir
+    _worker['log'] = []
+    _worker['runner'] = None
+    try:
+        _load_project()
+    except Exception:
+        # Retried on the first invocation, which then reports the error to the task
+        logger.exception(f'Worker {os.getpid()} could not load the dbt project')
+
+
+def _invoke(args):
+    """Run a dbt command in a warm worker and return a picklable summary."""
+    _worker['log'] = []
+    try:
+        if _worker['runner'] is None or project_fingerprint(_worker['project_dir']) != _worker['fingerprint']:
+            logger.info(f'Worker {os.getpid()} parsing the dbt project')
+            _load_project()
+        result = _worker['runner'].invoke(['--no-write-json'] + list(args))
+    except Exception:
+        return {'success': False, 'error': traceback.format_exc(), 'results': [], 'log': _worker['log']}
+
+    results = []
+    for node_result in getattr(result.result, 'results', None) or []:
+        results.append({
+            'node': node_result.node.name,
+            'status': str(node_result.status),
+            'message': node_result.message,
+            'execution_time': node_result.execution_time,
+        })
+    return {
+        'success': result.success,
+        'error': str(result.exception) if result.exception else None,
+        'results': results,
+        'log': _worker['log'],
+    }
+
+
+def _worker_main(connection, init, init_args, invoke):
+    """Body of a worker process: load the project, then run invocations until the server goes away."""
+    init(*init_args)
+    while True:
+        try:
+            args = connection.recv()
+        except EOFError:
+            return
+        connection.send(invoke(args))
+
+
+def failure(error):
+    return {'success': False, 'error': error, 'results': [], 'log': []}
+
+
+class Worker:
+    """A warm worker process and the server end of its pipe."""
+
+    def __init__(self, init, init_args, invoke):
+        self.connection, child = MP_CONTEXT.Pipe()
+        self.process = MP_CONTEXT.Process(target=_worker_main, args=(child, init, init_args, invoke), daemon=True)
+        self.process.start()
+        child.close()
+        self.invocations = 0
+
+    def stop(self):
+        self.connection.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+
+class WorkerPool:
+    """Fixed number of warm workers, handed out to one invocation at a time."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, project_dir=PROJECT_DIR, init=_init_worker, invoke=_invoke,
+                 max_invocations=MAX_INVOCATIONS_PER_WORKER):
+        self.init_args = (project_dir,)
+        self.init = init
+        self.invoke = invoke
+        self.max_invocations = max_invocations
+        self.idle = queue.Queue()
+        for _ in range(workers):
+            self.idle.put(self.start_worker())
+
+    def start_worker(self):
+        return Worker(self.init, self.init_args, self.invoke)
+
+    def release(self, worker, healthy):
+        """Return a worker to the pool, or a fresh one in its place."""
+        if not healthy or worker.invocations >= self.max_invocations:
+            worker.stop()
+            worker = self.start_worker()
+        self.idle.put(worker)
+
+    def run(self, args, cancelled):
+        """Run a dbt command in an idle worker and return its response, or None when cancelled.
+
+        cancelled is polled while waiting for a worker and while the worker runs.
+        """
+        while True:
+            try:
+                worker = self.idle.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if cancelled():
+                    return None
+        healthy = False
+        try:
+            worker.connection.send(list(args))
+            worker.invocations += 1
+            while not worker.connection.poll(POLL_INTERVAL):
+                if cancelled():
+                    logger.info(f'Cancelling dbt {" ".join(args)} in worker {worker.process.pid}')
+                    return None
+            try:
+                response = worker.connection.recv()
+            except EOFError:
+                worker.process.join(timeout=1)
+                return failure(f'dbt worker {worker.process.pid} exited with code {worker.process.exitcode} '
+                               f'while running dbt {" ".join(args)}')
+            healthy = True
+            return response
+        finally:
+            self.release(worker, healthy)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+
+def client_gone(connection):
+    """True once the client has sent a cancel request or closed its connection."""
+    try:
+        if not connection.poll(0):
+            return False
+        return bool(connection.recv().get('cancel'))
+    except (EOFError, OSError):
+        return True
+
+
+def _serve_connection(connection, pool):
+    with connection:
+        try:
+            request = connection.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            response = pool.run(request['args'], lambda: client_gone(connection))
+        except Exception:
+            response = failure(traceback.format_exc())
+        if response is None:
+            return
+        try:
+            connection.send(response)
+        except OSError:
+            logger.warning('Client went away before the dbt response could be sent')
+
+
+def serve_connections(listener, pool):
+    """Accept clients until the listener is closed, one thread per client."""
+    while True:
+        try:
+            connection = listener.accept()
+        except AuthenticationError:
+            logger.warning('Rejected a client with a wrong authentication key')
+            continue
+        except OSError:
+            return
+        threading.Thread(target=_serve_connection, args=(connection, pool), daemon=True).start()
+
+
+def serve(address=DEFAULT_ADDRESS, workers=DEFAULT_WORKERS, authkey=DEFAULT_AUTHKEY, project_dir=PROJECT_DIR):
+    if isinstance(address, str) and os.path.exists(address):
+        os.unlink(address)
+    pool = WorkerPool(workers, project_dir)
+    try:
+        with Listener(address, authkey=authkey) as listener:
+            logger.info(f'dbt runner pool with {workers} workers listening on {address}')
+            serve_connections(listener, pool)
+    finally:
+        pool.close()
+
+
+def connect(address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY):
+    try:
+        return Client(address, authkey=authkey)
+    except (OSError, EOFError) as e:
+        raise DbtRunnerPoolUnavailable(f'dbt runner pool at {address} is not reachable: {e}') from e
+
+
+def run_in_pool(args, address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY, timeout=DEFAULT_TIMEOUT, connection=None):
+    """Send a dbt command line (e.g. ['run', '--models', 'x']) to the pool and wait for the result.
+
+    Pass a connection from connect() to be able to cancel() the run from another thread.
+    Closing the connection, also on timeout, cancels the run in the pool.
+    """
+    connection = connection or connect(address, authkey)
+    with connection:
+        try:
+            connection.send({'args': list(args)})
+            if not connection.poll(timeout):
+                raise DbtRunnerPoolTimeout(f'dbt runner pool did not answer within {timeout}s, the run was cancelled')
+            return connection.recv()
+        except (EOFError, ConnectionError) as e:
+            raise DbtRunnerPoolUnavailable(f'dbt runner pool at {address} closed the connection: {e!r}') from e
+
+
+def cancel(connection):
+    """Ask the pool to stop the run sent on connection. Best effort."""
+    try:
+        connection.send({'cancel': True})
+    except (OSError, ValueError):
+        pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Serve dbt invocations from a pool of warm workers.')
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help='Unix socket path to listen on')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--project-dir', default=PROJECT_DIR)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    args = parse_args()
+    serve(args.address, args.workers, project_dir=args.project_dir)
@@ -0,0 +1,100 @@
+"""Optional sharded run of the daily_orders model.
+
+With N > 1 shards, 4_daily_dbt_models counts the day's orders in N mapped
+tasks instead of one query. Each task counts the orders of one hash shard of
+user_id into dbt.daily_orders__partials, on its own Postgres backend. The
+daily_orders task then runs dbt with the var `sharded: true`, and the model
+sums the partial counts instead of scanning clean_orders.
+
+The shard count is DBT_DAILY_SHARDS, or `daily_shards` in the DAG run
+configuration. With 0 or 1 shards no shard task runs and daily_orders runs
+as a single query.
+"""
+import logging
+import os
+from contextlib import closing
+
+from airflow.providers.postgres.hooks.postgres import PostgresHook
+from psycopg2 import sql
+
+SCHEMA = os.environ.get('DBT_DBT_SCHEMA', 'dbt')
+PARTIALS_TABLE = 'daily_orders__partials'
+SOURCE_TABLE = 'clean_orders'
+SHARDS_ENV = 'DBT_DAILY_SHARDS'
+POSTGRES_CONN_ID = 'dbt_postgres_instance_raw_data'
+
+log = logging.getLogger(__name__)
+
+PARTIALS_DDL = """
+    create table if not exists {table} (
+        ds date not null,
+        shard integer not null,
+        dt date not null,
+        daily_orders_count bigint not null,
+        primary key (ds, shard, dt)
+    )
+"""
+
+# hashtext() is signed: the mask keeps it non-negative, so mod() spreads users over 0..N-1
+SHARD_COUNT_SQL = """
+    insert into {partials} (ds, shard, dt, daily_orders_count)
+    select %(ds)s, %(shard)s, date(order_date), count(order_id)
+    from {source}
+    where order_date >= %(start_date)s and order_date < %(end_date)s
+        and mod(hashtext(user_id::text) & 2147483647, %(shards)s) = %(shard)s
+    group by date(order_date)
+"""
+
+
+def shard_count(conf=None):
+    """Number of shards from the DAG run configuration, else from the environment."""
+    value = (conf or {}).get('daily_shards', os.environ.get(SHARDS_ENV) or 0)
+    return max(int(value), 0)
+
+
+def shard_args(shards):
+    """Arguments of the mapped shard tasks, one [shard, shards] per task. Empty when not sharded."""
+    return [[shard, shards] for shard in range(shards)] if shards > 1 else []
+
+
+def table(name, schema=SCHEMA):
+    return sql.SQL('{}.{}').format(sql.Identifier(schema), sql.Identifier(name))
+
+
+def prepare_partials(cursor, ds, schema=SCHEMA):
+    """Create the partials table and clear the rows of an earlier run of this day."""
+    cursor.execute(sql.SQL(PARTIALS_DDL).format(table=table(PARTIALS_TABLE, schema)))
+    cursor.execute(sql.SQL('delete from {} where ds = %s').format(table(PARTIALS_TABLE, schema)), (ds,))
+
+
+def count_shard(cursor, ds, start_date, end_date, shard, shards, schema=SCHEMA):
+    """Replace the partial daily counts of one shard. Returns the number of days counted."""
+    cursor.execute(sql.SQL('delete from {} where ds = %s and shard = %s').format(table(PARTIALS_TABLE, schema)),
+                   (ds, shard))
+    cursor.execute(sql.SQL(SHARD_COUNT_SQL).format(partials=table(PARTIALS_TABLE, schema),
+                                                   source=table(SOURCE_TABLE, schema)),
+                   {'ds': ds, 'shard': shard, 'shards': shards, 'start_date': start_date, 'end_date': end_date})
+    return cursor.rowcount
+
+
+def plan_shards(ds, dag_run=None, postgres_conn_id=POSTGRES_CONN_ID):
+    """PythonOperator callable: prepare the partials of the day and return the arguments of the shard tasks."""
+    shards = shard_count(dag_run.conf if dag_run else None)
+    args = shard_args(shards)
+    if args:
+        with closing(PostgresHook(postgres_conn_id=postgres_conn_id).get_conn()) as conn, conn.cursor() as cursor:
+            prepare_partials(cursor, ds)
+            conn.commit()
+        log.info(f'Counting the daily orders of {ds} in {shards} shards')
+    else:
+        log.info(f'Sharding disabled ({shards} shards): daily_orders runs as a single query')
+    return args
+
+
+def run_shard(shard, shards, ds, start_date, end_date, postgres_conn_id=POSTGRES_CONN_ID):
+    """PythonOperator callable of one mapped shard task."""
+    with closing(PostgresHook(postgres_conn_id=postgres_conn_id).get_conn()) as conn, conn.cursor() as cursor:
+        days = count_shard(cursor, ds, start_date, end_date, shard, shards)
+        conn.commit()
+    log.info(f'Shard {shard}/{shards}: counted orders of {days} days')
+    return days
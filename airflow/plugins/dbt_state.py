@@ -0,0 +1,187 @@
+"""Build state of dbt models, used to skip models whose inputs have not changed.
+
+After every successful run DbtRunOperator records, per model, the checksum of
+its SQL file, the build id of each parent model, and a fingerprint of each
+upstream source table. On the next run the model only needs rebuilding if one
+of those differs.
+
+The SQL checksum is computed from the file on disk, the way dbt computes the
+one in manifest.json: the manifest is only rewritten by the next dbt parse, so
+an edited model would otherwise look unchanged until then.
+
+A raw table loaded by 1_load_initial_data is fingerprinted by the sha256 of
+the file it was loaded from, as recorded in dbt_raw_data._load_state. Any other
+source by its row count and the newest xmin among its rows: every committed
+insert or update writes rows with a newer xmin, and a delete lowers the count.
+The pg_stat_user_tables write counters are not used, since they are updated
+lazily and reset to zero by a crash or pg_stat_reset(). After a transaction id
+wraparound the newest xmin can go back to a recorded value: trigger the DAG
+with {"force_rebuild": true} then.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+JSON_MANIFEST_DBT = '/dbt/target/manifest.json'
+PROJECT_DIR = '/dbt'
+STATE_DIR = os.environ.get('DBT_RUN_STATE_DIR', '/dbt/target/run_state')
+
+RAW_SCHEMA = 'dbt_raw_data'
+# File checksums of the raw tables, kept by raw_data_loader.py and cleared by generate_instacart_data.py
+LOAD_STATE_TABLE = '_load_state'
+
+FINGERPRINT_SQL = 'select count(*), coalesce(max(xmin::text::bigint), 0) from {}.{}'
+
+
+def load_manifest(path=JSON_MANIFEST_DBT, attempts=5, delay=0.5):
+    """Load manifest.json, retrying a partial read: the dbt CLI rewrites it in place."""
+    for attempt in range(attempts):
+        with open(path) as json_data:
+            content = json_data.read()
+        try:
+            return json.loads(content)
+        except ValueError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay)
+
+
+def with_file_checksum(node, project_dir=PROJECT_DIR):
+    """Return the node with the sha256 and raw code of its SQL file as it is on disk now.
+
+    This is the checksum dbt itself records for the file. The manifest ones are
+    kept when the file cannot be read.
+    """
+    try:
+        with open(os.path.join(project_dir, node['original_file_path']), 'rb') as handle:
+            content = handle.read()
+    except (KeyError, OSError):
+        return node
+    return dict(node, checksum={'name': 'sha256', 'checksum': hashlib.sha256(content).hexdigest()},
+                raw_code=content.decode())
+
+
+def model_node(manifest, model):
+    """Return (unique_id, node) of a model by name, or (None, None)."""
+    for unique_id, node in manifest['nodes'].items():
+        if node['resource_type'] == 'model' and node['name'] == model:
+            return unique_id, node
+    return None, None
+
+
+def parent_models(manifest, unique_id):
+    return sorted({manifest['nodes'][parent]['name'] for parent in manifest['parent_map'][unique_id]
+                   if parent.startswith('model.')})
+
+
+def source_relations(manifest, unique_id):
+    """Return the (schema, table) of every source the node selects from."""
+    relations = set()
+    for parent in manifest['parent_map'][unique_id]:
+        if parent.startswith('source.'):
+            source = manifest['sources'][parent]
+            relations.add((source['schema'], source['identifier']))
+    return sorted(relations)
+
+
+def relation_name(schema, table):
+    return f'{schema}.{table}'
+
+
+def loaded_checksums(cursor):
+    """Return {table: sha256} of the raw tables loaded by 1_load_initial_data."""
+    if not relation_exists(cursor, RAW_SCHEMA, LOAD_STATE_TABLE):
+        return {}
+    cursor.execute(f'select table_name, sha256 from {RAW_SCHEMA}.{LOAD_STATE_TABLE}')
+    return dict(cursor.fetchall())
+
+
+def relation_fingerprints(cursor, relations):
+    """Return {schema.table: {'sha256': ...} or [rows, newest xmin]}; None for missing tables."""
+    # Imported here so that the generator script can use this module's constants without psycopg2
+    from psycopg2 import sql
+
+    loaded = loaded_checksums(cursor)
+    fingerprints = {}
+    for schema, table in relations:
+        name = relation_name(schema, table)
+        if not relation_exists(cursor, schema, table):
+            fingerprints[name] = None
+        elif schema == RAW_SCHEMA and table in loaded:
+            fingerprints[name] = {'sha256': loaded[table]}
+        else:
+            cursor.execute(sql.SQL(FINGERPRINT_SQL).format(sql.Identifier(schema), sql.Identifier(table)))
+            fingerprints[name] = list(cursor.fetchone())
+    return fingerprints
+
+
+def relation_exists(cursor, schema, table):
+    cursor.execute('select to_regclass(%s) is not null', (relation_name(schema, table),))
+    return cursor.fetchone()[0]
+
+
+def state_path(model, state_dir=STATE_DIR):
+    return os.path.join(state_dir, f'{model}.json')
+
+
+def read_state(model, state_dir=STATE_DIR):
+    try:
+        with open(state_path(model, state_dir)) as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_state(model, state, state_dir=STATE_DIR):
+    """Write the state file atomically, so concurrent readers never see a partial file."""
+    os.makedirs(state_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=state_dir, prefix=f'.{model}.')
+    with os.fdopen(fd, 'w') as handle:
+        json.dump(state, handle, indent=2)
+    os.replace(tmp_path, state_path(model, state_dir))
+
+
+def parent_builds(parents, state_dir=STATE_DIR):
+    """Return {parent: build_id} from the parents' recorded state."""
+    return {parent: (read_state(parent, state_dir) or {}).get('build_id') for parent in parents}
+
+
+def parents_reproducible(parents, state_dir=STATE_DIR):
+    """True if every parent's build id is derived from its inputs (see dbt_result_cache.py)."""
+    return all((read_state(parent, state_dir) or {}).get('reproducible', False) for parent in parents)
+
+
+def new_state(model, node, sources, parents, duration, build_id=None):
+    return {
+        'model': model,
+        'checksum': node['checksum']['checksum'],
+        'sources': sources,
+        'parents': parents,
+        'build_id': build_id or uuid.uuid4().hex,
+        'built_at': datetime.utcnow().isoformat(),
+        'duration': duration,
+    }
+
+
+def change_reasons(node, previous, sources, parents):
+    """List why a model needs rebuilding compared with its previous state. Empty if unchanged."""
+    if previous is None:
+        return ['no previous successful build recorded']
+    reasons = []
+    if previous.get('checksum') != node['checksum']['checksum']:
+        reasons.append('model SQL changed')
+    for relation, fingerprint in sources.items():
+        if fingerprint is None:
+            reasons.append(f'source {relation} does not exist')
+        elif previous.get('sources', {}).get(relation) != fingerprint:
+            reasons.append(f'source {relation} changed')
+    for parent, build_id in parents.items():
+        if build_id is None:
+            reasons.append(f'parent {parent} has no recorded build')
+        elif previous.get('parents', {}).get(parent) != build_id:
+            reasons.append(f'parent {parent} was rebuilt')
+    return reasons
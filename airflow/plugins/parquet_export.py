@@ -0,0 +1,216 @@
+"""Export dbt models to zstd-compressed Parquet for the Streamlit app.
+
+Rows are streamed from postgres-dbt through a server-side (named) cursor, so
+an export never holds more than one batch in memory, and written with
+pyarrow. Each model is exported to its own directory under EXPORT_DIR,
+optionally Hive-partitioned (e.g. `month=2019-01/part-0.parquet`), next to an
+`_export.json` manifest. Readers ignore files starting with `_` or `.`.
+
+A full export is written to a staging directory and swapped in with a rename.
+With `where`, only the partitions it returns are replaced, the others are
+kept. A full export is skipped when the model's build id (see dbt_state.py)
+has not changed since the last export.
+"""
+import glob
+import json
+import os
+import shutil
+import uuid
+from collections import defaultdict
+from contextlib import closing
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from airflow.exceptions import AirflowException, AirflowSkipException
+from airflow.models import BaseOperator
+from airflow.providers.postgres.hooks.postgres import PostgresHook
+from psycopg2 import sql
+
+import dbt_state
+from dbt_operator import DbtRunOperator
+
+EXPORT_DIR = os.environ.get('EXPORT_DIR', '/exports')
+MANIFEST_FILE = '_export.json'
+BATCH_SIZE = 50000
+PARTITION_COLUMN = '__partition'
+
+# Postgres type oids to Arrow types. numeric is exported as float64, anything else as text.
+PG_TYPES = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1700: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp('us'),
+    1184: pa.timestamp('us', tz='UTC'),
+}
+
+
+def arrow_schema(description):
+    return pa.schema([pa.field(column.name, PG_TYPES.get(column.type_code, pa.string())) for column in description])
+
+
+def record_batch(rows, schema):
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if pa.types.is_string(field.type):
+            values = [None if value is None else str(value) for value in values]
+        elif pa.types.is_floating(field.type):
+            values = [None if value is None else float(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def export_query(conn, query, output_dir, partition_name=None, batch_size=BATCH_SIZE, cursor_name='parquet_export'):
+    """Stream the result of query into Parquet files under output_dir and return the number of rows.
+
+    With partition_name, the last column of the result is the partition value:
+    it is not written, rows go to `<output_dir>/<partition_name>=<value>/part-0.parquet`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    writers = {}
+    rows_written = 0
+
+    def writer(path, schema):
+        if path not in writers:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            writers[path] = pq.ParquetWriter(path, schema, compression='zstd')
+        return writers[path]
+
+    try:
+        with conn.cursor(name=cursor_name) as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(query)
+            rows = cursor.fetchmany(batch_size)
+            # A named cursor only describes its columns once rows have been fetched
+            schema = arrow_schema(cursor.description)
+            if partition_name:
+                schema = schema.remove(len(schema) - 1)
+            else:
+                writer(os.path.join(output_dir, 'part-0.parquet'), schema)
+            while rows:
+                if partition_name:
+                    partitions = defaultdict(list)
+                    for row in rows:
+                        partitions[row[-1]].append(row[:-1])
+                    for value, partition_rows in partitions.items():
+                        path = os.path.join(output_dir, f'{partition_name}={value}', 'part-0.parquet')
+                        writer(path, schema).write_batch(record_batch(partition_rows, schema))
+                else:
+                    writer(os.path.join(output_dir, 'part-0.parquet'), schema).write_batch(record_batch(rows, schema))
+                rows_written += len(rows)
+                rows = cursor.fetchmany(batch_size)
+    finally:
+        for parquet_writer in writers.values():
+            parquet_writer.close()
+    return rows_written
+
+
+def replace_dir(staging, target):
+    """Swap staging in for target. Readers see either the old or the new directory, never a partial one."""
+    old = f'{target}.old-{uuid.uuid4().hex[:8]}'
+    if os.path.exists(target):
+        os.rename(target, old)
+    os.rename(staging, target)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def read_export_manifest(target):
+    try:
+        with open(os.path.join(target, MANIFEST_FILE)) as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_export_manifest(target, model, build_id, partition_name=None):
+    files = sorted(glob.glob(os.path.join(target, '**', '*.parquet'), recursive=True))
+    manifest = {
+        'model': model,
+        'build_id': build_id,
+        'exported_at': datetime.utcnow().isoformat(),
+        'rows': sum(pq.ParquetFile(path).metadata.num_rows for path in files),
+        'partition_name': partition_name,
+        'partitions': sorted(name for name in os.listdir(target) if partition_name and name.startswith(f'{partition_name}=')),
+    }
+    tmp_path = os.path.join(target, f'.{MANIFEST_FILE}.tmp')
+    with open(tmp_path, 'w') as handle:
+        json.dump(manifest, handle, indent=2)
+    os.replace(tmp_path, os.path.join(target, MANIFEST_FILE))
+    return manifest
+
+
+class ParquetExportOperator(BaseOperator):
+    """Export a dbt model to Parquet under export_dir/<model>.
+
+    partition_by is a SQL expression over the model's columns (e.g.
+    "to_char(dt, 'YYYY-MM')") whose value names the partition directory
+    `<partition_name>=<value>`. where (templated) limits the export to whole
+    partitions, and only the partitions present in the result are replaced.
+    The first export of a model is always a full one.
+    """
+    template_fields = ('where',)
+    ui_color = '#50c2a0'
+
+    def __init__(self, model, export_dir=EXPORT_DIR, partition_by=None, partition_name='partition', where=None,
+                 batch_size=BATCH_SIZE, postgres_conn_id='dbt_postgres_instance_raw_data',
+                 manifest_path=dbt_state.JSON_MANIFEST_DBT, state_dir=dbt_state.STATE_DIR,
+                 *args, **kwargs):
+        super(ParquetExportOperator, self).__init__(*args, **kwargs)
+        self.model = model
+        self.export_dir = export_dir
+        self.partition_by = partition_by
+        self.partition_name = partition_name
+        self.where = where
+        self.batch_size = batch_size
+        self.postgres_conn_id = postgres_conn_id
+        self.manifest_path = manifest_path
+        self.state_dir = state_dir
+
+    def query(self, schema, alias, where):
+        query = sql.SQL('select *{} from {}.{}').format(
+            sql.SQL(f', ({self.partition_by}) as {PARTITION_COLUMN}') if self.partition_by else sql.SQL(''),
+            sql.Identifier(schema), sql.Identifier(alias))
+        if where:
+            query += sql.SQL(f' where {where}')
+        return query
+
+    def execute(self, context):
+        manifest = dbt_state.load_manifest(self.manifest_path)
+        _, node = dbt_state.model_node(manifest, self.model)
+        if node is None:
+            raise AirflowException(f'Model {self.model} not found in {self.manifest_path}')
+        build_id = (dbt_state.read_state(self.model, self.state_dir) or {}).get('build_id')
+        target = os.path.join(self.export_dir, self.model)
+        previous = read_export_manifest(target)
+        partial = bool(self.where and self.partition_by and previous)
+
+        if (not partial and previous and build_id and previous.get('build_id') == build_id
+                and not DbtRunOperator.force_rebuild(context)):
+            raise AirflowSkipException(f'{self.model} is unchanged since its export at {previous["exported_at"]}')
+
+        staging = os.path.join(self.export_dir, f'.{self.model}.staging-{uuid.uuid4().hex[:8]}')
+        partition_name = self.partition_name if self.partition_by else None
+        try:
+            with closing(PostgresHook(postgres_conn_id=self.postgres_conn_id).get_conn()) as conn:
+                query = self.query(node['schema'], node['alias'], self.where if partial else None)
+                rows = export_query(conn, query, staging, partition_name, self.batch_size,
+                                    cursor_name=f'export_{self.model}')
+            if partial:
+                os.makedirs(target, exist_ok=True)
+                for partition in sorted(os.listdir(staging)):
+                    replace_dir(os.path.join(staging, partition), os.path.join(target, partition))
+                    self.log.info(f'Replaced {self.model}/{partition}')
+            else:
+                replace_dir(staging, target)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        export = write_export_manifest(target, self.model, build_id, partition_name)
+        self.log.info(f'Exported {rows} rows of {node["schema"]}.{node["alias"]} to {target} '
+                      f'({export["rows"]} rows in total)')
+        return export
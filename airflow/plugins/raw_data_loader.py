@@ -0,0 +1,224 @@
+"""Incremental load of the Instacart CSVs into dbt_raw_data.
+
+For every table the loader records, in dbt_raw_data._load_state, the sha256,
+byte size and row count of the CSV it last loaded (the content of
+`<table>.csv`, or of the `<table>.csv` inside `<table>.csv.zip`). On the next
+run each table is
+
+* skipped, when the file content is unchanged,
+* appended to, when the table is append-only and the file still starts with
+  exactly the content loaded last time: only the new tail of rows is copied,
+* otherwise dropped, re-created and loaded in full.
+
+A file whose size and modification time are unchanged is skipped without
+being read. Otherwise it is read once: hashing the whole content also yields
+the hash of the previously loaded prefix. Rows are sent with COPY FROM STDIN, and each
+load commits together with its state row, so an interrupted load is simply
+redone. CSV fields are assumed not to contain line breaks.
+"""
+import hashlib
+import logging
+import os
+import zipfile
+from contextlib import closing, contextmanager
+
+from airflow.exceptions import AirflowSkipException
+from airflow.providers.postgres.hooks.postgres import PostgresHook
+from psycopg2 import sql
+
+from dbt_state import LOAD_STATE_TABLE, RAW_SCHEMA
+
+RAW_DATA_DIR = os.environ.get('RAW_DATA_DIR', '/sample_data')
+POSTGRES_CONN_ID = 'dbt_postgres_instance_raw_data'
+CHUNK_SIZE = 1 << 20
+
+log = logging.getLogger(__name__)
+
+# table -> (column definitions, append-only)
+TABLES = {
+    'aisles': ('aisle_id integer, aisle varchar(100)', False),
+    'departments': ('department_id integer, department varchar(100)', False),
+    'products': ('product_id integer, product_name varchar(200), aisle_id integer, department_id integer', False),
+    'orders': ('order_id integer, user_id integer, eval_set varchar(10), order_number integer, order_dow integer, '
+               'order_hour_of_day integer, days_since_prior_order real', True),
+    'order_products__prior': ('order_id integer, product_id integer, add_to_cart_order integer, reordered integer', True),
+    'order_products__train': ('order_id integer, product_id integer, add_to_cart_order integer, reordered integer', True),
+}
+
+STATE_DDL = """
+    create table if not exists {table} (
+        table_name text primary key,
+        file_name text not null,
+        sha256 text not null,
+        rows bigint not null,
+        bytes bigint not null,
+        file_bytes bigint,
+        file_mtime double precision,
+        loaded_at timestamp not null default now()
+    )
+"""
+
+
+def source_path(table, data_dir=RAW_DATA_DIR):
+    """Return the CSV of a table, plain or zipped."""
+    for name in (f'{table}.csv', f'{table}.csv.zip'):
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f'No {table}.csv or {table}.csv.zip in {data_dir}')
+
+
+@contextmanager
+def open_source(path):
+    """Open the CSV content of a plain or zipped file as a binary stream."""
+    if not path.endswith('.zip'):
+        with open(path, 'rb') as stream:
+            yield stream
+        return
+    with zipfile.ZipFile(path) as archive:
+        member = os.path.basename(path)[:-len('.zip')]
+        if member not in archive.namelist():
+            member = archive.namelist()[0]
+        with archive.open(member) as stream:
+            yield stream
+
+
+def scan(path, prefix_bytes=None, chunk_size=CHUNK_SIZE):
+    """Hash and count a CSV in one pass.
+
+    With prefix_bytes, also return the sha256 of the first prefix_bytes bytes
+    and whether they end on a line break.
+    """
+    digest = hashlib.sha256()
+    size = newlines = 0
+    last_byte = b''
+    prefix_sha256 = prefix_at_line_end = None
+    with open_source(path) as stream:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            if prefix_bytes is not None and size < prefix_bytes <= size + len(chunk):
+                head = chunk[:prefix_bytes - size]
+                prefix_digest = digest.copy()
+                prefix_digest.update(head)
+                prefix_sha256 = prefix_digest.hexdigest()
+                prefix_at_line_end = head.endswith(b'\n')
+            digest.update(chunk)
+            size += len(chunk)
+            newlines += chunk.count(b'\n')
+            last_byte = chunk[-1:]
+    if prefix_bytes == 0:
+        prefix_sha256, prefix_at_line_end = hashlib.sha256().hexdigest(), True
+    lines = newlines + (1 if last_byte not in (b'', b'\n') else 0)
+    return {
+        'sha256': digest.hexdigest(),
+        'bytes': size,
+        'rows': max(lines - 1, 0),  # without the header
+        'prefix_sha256': prefix_sha256,
+        'prefix_at_line_end': prefix_at_line_end,
+    }
+
+
+def plan_load(state, scanned, append_only, table_exists=True):
+    """Return 'skip', 'append' or 'full'."""
+    if state is None or not table_exists:
+        return 'full'
+    if scanned['sha256'] == state['sha256'] and scanned['bytes'] == state['bytes']:
+        return 'skip'
+    if (append_only and scanned['bytes'] > state['bytes'] and scanned['prefix_sha256'] == state['sha256']
+            and scanned['prefix_at_line_end']):
+        return 'append'
+    return 'full'
+
+
+def skip_bytes(stream, offset, chunk_size=CHUNK_SIZE):
+    """Advance a stream by offset bytes (zip members cannot seek cheaply) and return it."""
+    while offset > 0:
+        skipped = stream.read(min(chunk_size, offset))
+        if not skipped:
+            break
+        offset -= len(skipped)
+    return stream
+
+
+def table_identifier(table, schema=RAW_SCHEMA):
+    return sql.SQL('{}.{}').format(sql.Identifier(schema), sql.Identifier(table))
+
+
+def ensure_state_table(cursor, schema=RAW_SCHEMA):
+    cursor.execute(sql.SQL('create schema if not exists {}').format(sql.Identifier(schema)))
+    cursor.execute(sql.SQL(STATE_DDL).format(table=table_identifier(LOAD_STATE_TABLE, schema)))
+
+
+def read_load_state(cursor, table, schema=RAW_SCHEMA):
+    columns = ('file_name', 'sha256', 'rows', 'bytes', 'file_bytes', 'file_mtime')
+    cursor.execute(sql.SQL('select {} from {} where table_name = %s').format(
+        sql.SQL(', ').join(map(sql.Identifier, columns)), table_identifier(LOAD_STATE_TABLE, schema)), (table,))
+    row = cursor.fetchone()
+    return dict(zip(columns, row)) if row else None
+
+
+def file_unchanged(state, stat):
+    """True if the file on disk has the size and modification time recorded at its last load."""
+    return bool(state) and state['file_bytes'] == stat.st_size and state['file_mtime'] == stat.st_mtime
+
+
+def write_load_state(cursor, table, file_name, scanned, stat, schema=RAW_SCHEMA):
+    cursor.execute(
+        sql.SQL('insert into {} (table_name, file_name, sha256, rows, bytes, file_bytes, file_mtime) '
+                'values (%s, %s, %s, %s, %s, %s, %s) '
+                'on conflict (table_name) do update set file_name = excluded.file_name, sha256 = excluded.sha256, '
+                'rows = excluded.rows, bytes = excluded.bytes, file_bytes = excluded.file_bytes, '
+                'file_mtime = excluded.file_mtime, loaded_at = now()')
+        .format(table_identifier(LOAD_STATE_TABLE, schema)),
+        (table, file_name, scanned['sha256'], scanned['rows'], scanned['bytes'], stat.st_size, stat.st_mtime))
+
+
+def load(cursor, table, path, state, scanned, mode, stat, schema=RAW_SCHEMA):
+    """Load a table in the given mode within the caller's transaction."""
+    columns, _ = TABLES[table]
+    relation = table_identifier(table, schema)
+    if mode == 'full':
+        cursor.execute(sql.SQL('drop table if exists {}').format(relation))
+        cursor.execute(sql.SQL('create table {} ({})').format(relation, sql.SQL(columns)))
+        with open_source(path) as stream:
+            cursor.copy_expert(sql.SQL('copy {} from stdin with (format csv, header true)').format(relation), stream)
+    elif mode == 'append':
+        with open_source(path) as stream:
+            cursor.copy_expert(sql.SQL('copy {} from stdin with (format csv)').format(relation),
+                               skip_bytes(stream, state['bytes']))
+    write_load_state(cursor, table, os.path.basename(path), scanned, stat, schema)
+
+
+def prepare(postgres_conn_id=POSTGRES_CONN_ID):
+    """PythonOperator callable: create the raw data schema and the load state table."""
+    with closing(PostgresHook(postgres_conn_id=postgres_conn_id).get_conn()) as conn, conn.cursor() as cursor:
+        ensure_state_table(cursor)
+        conn.commit()
+
+
+def load_table(table, data_dir=RAW_DATA_DIR, postgres_conn_id=POSTGRES_CONN_ID):
+    """PythonOperator callable: load one table, skipping it when its file is unchanged."""
+    path = source_path(table, data_dir)
+    stat = os.stat(path)
+    _, append_only = TABLES[table]
+    with closing(PostgresHook(postgres_conn_id=postgres_conn_id).get_conn()) as conn, conn.cursor() as cursor:
+        state = read_load_state(cursor, table)
+        cursor.execute('select to_regclass(%s) is not null', (f'{RAW_SCHEMA}.{table}',))
+        exists = cursor.fetchone()[0]
+        if exists and file_unchanged(state, stat):
+            raise AirflowSkipException(f'{path} is unchanged since its last load ({state["rows"]} rows)')
+
+        scanned = scan(path, prefix_bytes=state['bytes'] if state and append_only else None)
+        mode = plan_load(state, scanned, append_only, exists)
+        if mode == 'skip':
+            # Same content in a touched file: record its new modification time to skip the scan next time
+            write_load_state(cursor, table, os.path.basename(path), scanned, stat)
+            conn.commit()
+            raise AirflowSkipException(f'The content of {path} is unchanged since its last load ({scanned["rows"]} rows)')
+        load(cursor, table, path, state, scanned, mode, stat)
+        conn.commit()
+    loaded = scanned['rows'] - state['rows'] if mode == 'append' else scanned['rows']
+    log.info(f'{"Appended" if mode == "append" else "Loaded"} {loaded} rows of {path} into {RAW_SCHEMA}.{table}')
+    return {'mode': mode, 'rows': loaded, 'sha256': scanned['sha256']}
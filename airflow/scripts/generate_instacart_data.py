@@ -0,0 +1,374 @@
+"""Synthetic Instacart data generator.
+
+Produces aisles, departments, products, orders and order_products tables that
+follow the shape of the Kaggle Instacart extract (orders per user, basket sizes,
+day/hour profiles, reorder ratio, skewed product popularity) at an arbitrary
+scale factor. Output is deterministic for a given seed and scale, regardless
+of the number of worker processes.
+
+Examples:
+    # 10x the Kaggle volume straight into postgres-dbt (run inside the airflow container)
+    python /airflow/scripts/generate_instacart_data.py --scale 10 --target postgres --create
+
+    # Zipped CSVs in the layout of ./sample_data, next to (not over) the Kaggle files
+    python airflow/scripts/generate_instacart_data.py --scale 0.1 --target zip --output-dir sample_data/synthetic
+"""
+import argparse
+import csv
+import io
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins'))
+
+from dbt_state import LOAD_STATE_TABLE, RAW_SCHEMA
+
+logger = logging.getLogger(__name__)
+# Kept apart from the git-tracked Kaggle zips in ./sample_data
+DEFAULT_OUTPUT_DIR = os.path.join('sample_data', 'synthetic')
+
+# Kaggle extract volumes at scale 1.0
+BASE_USERS = 206209
+NUM_PRODUCTS = 49688
+NUM_AISLES = 134
+
+# Users are generated in fixed-size chunks, each with its own seeded RNG, so the
+# output does not depend on how chunks are spread over processes.
+CHUNK_USERS = 5000
+
+# Order ids are derived from (user_id, order_number) so they are unique without
+# coordination between workers. They must fit in the `integer` columns.
+MAX_ORDERS_PER_USER = 100
+MAX_INT = 2 ** 31 - 1
+
+DEPARTMENTS = [
+    'frozen', 'other', 'bakery', 'produce', 'alcohol', 'international',
+    'beverages', 'pets', 'dry goods pasta', 'bulk', 'personal care',
+    'meat seafood', 'pantry', 'breakfast', 'canned goods', 'dairy eggs',
+    'household', 'babies', 'snacks', 'deli', 'missing',
+]
+
+# Relative frequencies observed in orders.csv
+ORDER_DOW_WEIGHTS = [600905, 587478, 467260, 436972, 426339, 453368, 448761]
+ORDER_HOUR_WEIGHTS = [
+    22758, 12398, 7539, 5474, 5527, 9569, 30529, 91868, 178201, 257812, 288418, 284728,
+    272841, 277999, 283042, 283639, 272553, 228795, 182912, 140569, 104292, 78109, 61468, 40043,
+]
+# days_since_prior_order 0..30, in thousands. Note the weekly and monthly spikes.
+DAYS_SINCE_PRIOR_WEIGHTS = [
+    67, 145, 194, 217, 221, 214, 240, 320, 181, 118, 95, 80, 76, 83, 100, 66,
+    46, 39, 35, 34, 38, 45, 32, 23, 20, 19, 19, 22, 26, 19, 369,
+]
+DOWS, DOW_CUM_WEIGHTS = range(7), list(itertools.accumulate(ORDER_DOW_WEIGHTS))
+HOURS, HOUR_CUM_WEIGHTS = range(24), list(itertools.accumulate(ORDER_HOUR_WEIGHTS))
+DAYS, DAYS_CUM_WEIGHTS = range(31), list(itertools.accumulate(DAYS_SINCE_PRIOR_WEIGHTS))
+
+MEAN_EXTRA_ORDERS = 12.6    # on top of the minimum of 4 orders per user
+MEAN_EXTRA_BASKET = 9.1     # on top of the minimum of 1 product per order
+MAX_BASKET = 145
+REORDER_PROBABILITY = 0.59
+TRAIN_USER_RATIO = 131209 / 206209
+PRODUCT_ZIPF_EXPONENT = 1.0
+
+TABLES = {
+    'aisles': ['aisle_id', 'aisle'],
+    'departments': ['department_id', 'department'],
+    'products': ['product_id', 'product_name', 'aisle_id', 'department_id'],
+    'orders': ['order_id', 'user_id', 'eval_set', 'order_number', 'order_dow',
+               'order_hour_of_day', 'days_since_prior_order'],
+    'order_products__prior': ['order_id', 'product_id', 'add_to_cart_order', 'reordered'],
+    'order_products__train': ['order_id', 'product_id', 'add_to_cart_order', 'reordered'],
+}
+DIMENSION_TABLES = ['aisles', 'departments', 'products']
+FACT_TABLES = ['orders', 'order_products__prior', 'order_products__train']
+
+TABLE_DDL = {
+    'aisles': "create table if not exists {schema}.aisles (aisle_id integer, aisle varchar(100))",
+    'departments': "create table if not exists {schema}.departments (department_id integer, department varchar(100))",
+    'products': "create table if not exists {schema}.products (product_id integer, product_name varchar(200), aisle_id integer, department_id integer)",
+    'orders': "create table if not exists {schema}.orders (order_id integer, user_id integer, eval_set varchar(10), order_number integer, order_dow integer, order_hour_of_day integer, days_since_prior_order real)",
+    'order_products__prior': "create table if not exists {schema}.order_products__prior (order_id integer, product_id integer, add_to_cart_order integer, reordered integer)",
+    'order_products__train': "create table if not exists {schema}.order_products__train (order_id integer, product_id integer, add_to_cart_order integer, reordered integer)",
+}
+
+
+def number_of_users(scale):
+    return max(1, int(round(BASE_USERS * scale)))
+
+
+def chunk_ranges(num_users, chunk_users=CHUNK_USERS):
+    """Yield (chunk_index, first_user_id, last_user_id_exclusive) tuples."""
+    for index, start in enumerate(range(1, num_users + 1, chunk_users)):
+        yield index, start, min(start + chunk_users, num_users + 1)
+
+
+def generate_dimensions(seed):
+    """Return rows for aisles, departments and products."""
+    rng = random.Random(f'{seed}:dimensions')
+    departments = [(i + 1, name) for i, name in enumerate(DEPARTMENTS)]
+    aisles = [(i + 1, f'aisle {i + 1}') for i in range(NUM_AISLES)]
+    aisle_department = {aisle_id: rng.randint(1, len(DEPARTMENTS)) for aisle_id, _ in aisles}
+    products = []
+    for product_id in range(1, NUM_PRODUCTS + 1):
+        aisle_id = rng.randint(1, NUM_AISLES)
+        products.append((product_id, f'Product {product_id}', aisle_id, aisle_department[aisle_id]))
+    return {'aisles': aisles, 'departments': departments, 'products': products}
+
+
+def product_popularity(seed):
+    """Return (product_ids, cumulative_weights) for Zipf-like product sampling.
+
+    Popularity rank is shuffled so that best sellers are spread over the id range.
+    """
+    product_ids = list(range(1, NUM_PRODUCTS + 1))
+    random.Random(f'{seed}:popularity').shuffle(product_ids)
+    weights = (1.0 / (rank ** PRODUCT_ZIPF_EXPONENT) for rank in range(1, NUM_PRODUCTS + 1))
+    return product_ids, list(itertools.accumulate(weights))
+
+
+def generate_user_chunk(seed, first_user, last_user, popularity=None):
+    """Generate orders and order_products rows for users in [first_user, last_user).
+
+    Returns a dict mapping each fact table name to a list of row tuples.
+    """
+    rng = random.Random(f'{seed}:users:{first_user}')
+    product_ids, cum_weights = popularity or product_popularity(seed)
+    orders, prior, train = [], [], []
+
+    for user_id in range(first_user, last_user):
+        order_count = min(MAX_ORDERS_PER_USER, 4 + int(rng.expovariate(1 / MEAN_EXTRA_ORDERS)))
+        last_eval_set = 'train' if rng.random() < TRAIN_USER_RATIO else 'test'
+        history = []
+        seen = set()
+        for order_number in range(1, order_count + 1):
+            order_id = (user_id - 1) * MAX_ORDERS_PER_USER + order_number
+            eval_set = last_eval_set if order_number == order_count else 'prior'
+            order_dow = rng.choices(DOWS, cum_weights=DOW_CUM_WEIGHTS)[0]
+            order_hour = rng.choices(HOURS, cum_weights=HOUR_CUM_WEIGHTS)[0]
+            if order_number == 1:
+                days_since_prior = ''
+            else:
+                days_since_prior = float(rng.choices(DAYS, cum_weights=DAYS_CUM_WEIGHTS)[0])
+            orders.append((order_id, user_id, eval_set, order_number, order_dow, order_hour, days_since_prior))
+
+            if eval_set == 'test':
+                # The Kaggle extract withholds the basket of test orders
+                continue
+            target = prior if eval_set == 'prior' else train
+            basket_size = min(MAX_BASKET, 1 + int(rng.expovariate(1 / MEAN_EXTRA_BASKET)))
+            basket = []
+            for _ in range(basket_size):
+                if history and rng.random() < REORDER_PROBABILITY:
+                    product_id = rng.choice(history)
+                else:
+                    product_id = rng.choices(product_ids, cum_weights=cum_weights)[0]
+                if product_id in basket:
+                    continue
+                basket.append(product_id)
+                target.append((order_id, product_id, len(basket), int(product_id in seen)))
+            for product_id in basket:
+                if product_id not in seen:
+                    seen.add(product_id)
+                    history.append(product_id)
+
+    return {'orders': orders, 'order_products__prior': prior, 'order_products__train': train}
+
+
+def rows_to_csv(rows, header=None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(header)
+    writer.writerows(rows)
+    buffer.seek(0)
+    return buffer
+
+
+def default_dsn():
+    """Build a libpq DSN from the postgres-dbt variables set in docker-compose.yml."""
+    return 'host={} port={} dbname={} user={} password={}'.format(
+        os.environ.get('DBT_POSTGRES_HOST', 'postgres-dbt'),
+        os.environ.get('POSTGRES_PORT', '5432'),
+        os.environ.get('DBT_POSTGRES_DB', 'dbtdb'),
+        os.environ.get('DBT_POSTGRES_USER', 'dbtuser'),
+        os.environ.get('DBT_POSTGRES_PASSWORD', 'pssd'),
+    )
+
+
+def copy_rows(connection, table, rows, schema=RAW_SCHEMA):
+    """Stream rows into a table through COPY FROM STDIN."""
+    sql = 'COPY {}.{} ({}) FROM STDIN WITH (FORMAT csv)'.format(schema, table, ', '.join(TABLES[table]))
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, rows_to_csv(rows))
+
+
+# Set once per worker process by _init_worker
+_worker_state = {}
+
+
+def _init_worker(seed, target, dsn, parts_dir):
+    _worker_state['popularity'] = product_popularity(seed)
+    _worker_state['target'] = target
+    _worker_state['parts_dir'] = parts_dir
+    if target == 'postgres':
+        import psycopg2
+        connection = psycopg2.connect(dsn)
+        _worker_state['connection'] = connection
+        # Runs when the worker exits after pool.close() / pool.join()
+        multiprocessing.util.Finalize(None, connection.close, exitpriority=10)
+
+
+def _generate_chunk(task):
+    seed, chunk_index, first_user, last_user = task
+    tables = generate_user_chunk(seed, first_user, last_user, _worker_state['popularity'])
+    if _worker_state['target'] == 'postgres':
+        connection = _worker_state['connection']
+        for table, rows in tables.items():
+            copy_rows(connection, table, rows)
+        connection.commit()
+    else:
+        for table, rows in tables.items():
+            part = os.path.join(_worker_state['parts_dir'], f'{table}.{chunk_index:08d}.csv')
+            with open(part, 'w', newline='') as handle:
+                csv.writer(handle, lineterminator='\n').writerows(rows)
+    return chunk_index, {table: len(rows) for table, rows in tables.items()}
+
+
+def write_zip(output_dir, table, header, parts):
+    """Write <table>.csv.zip containing <table>.csv made of a header and the given part files."""
+    path = os.path.join(output_dir, f'{table}.csv.zip')
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(f'{table}.csv', 'w', force_zip64=True) as member:
+            member.write((','.join(header) + '\n').encode())
+            for part in parts:
+                with open(part, 'rb') as handle:
+                    shutil.copyfileobj(handle, member)
+    return path
+
+
+def prepare_database(connection, truncate):
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {RAW_SCHEMA}')
+        for table in TABLES:
+            cursor.execute(TABLE_DDL[table].format(schema=RAW_SCHEMA))
+            if truncate:
+                cursor.execute(f'TRUNCATE {RAW_SCHEMA}.{table}')
+    connection.commit()
+
+
+def forget_load_state(connection):
+    """Drop the file checksums 1_load_initial_data recorded for the tables written here.
+
+    The dbt result cache keys raw tables on them, and they no longer describe the content.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT to_regclass('{RAW_SCHEMA}.{LOAD_STATE_TABLE}') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute(f'DELETE FROM {RAW_SCHEMA}.{LOAD_STATE_TABLE} WHERE table_name = ANY(%s)', (list(TABLES),))
+    connection.commit()
+
+
+def existing_outputs(output_dir):
+    """Return the <table>.csv.zip files already present in output_dir."""
+    paths = (os.path.join(output_dir, f'{table}.csv.zip') for table in TABLES)
+    return [path for path in paths if os.path.exists(path)]
+
+
+def generate(scale, seed, target, workers, output_dir=None, dsn=None, create=False, overwrite=False):
+    num_users = number_of_users(scale)
+    if num_users * MAX_ORDERS_PER_USER > MAX_INT:
+        raise ValueError(f'Scale {scale} produces order ids that overflow the integer order_id column')
+    if target == 'zip' and not overwrite:
+        existing = existing_outputs(output_dir)
+        if existing:
+            raise FileExistsError(f'{", ".join(existing)} already exist, pass --overwrite to replace them')
+
+    started = time.monotonic()
+    dimensions = generate_dimensions(seed)
+    parts_dir = None
+    if target == 'postgres':
+        import psycopg2
+        connection = psycopg2.connect(dsn)
+        try:
+            forget_load_state(connection)
+            if create:
+                prepare_database(connection, truncate=True)
+            for table in DIMENSION_TABLES:
+                copy_rows(connection, table, dimensions[table])
+            connection.commit()
+        finally:
+            connection.close()
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+        for table in DIMENSION_TABLES:
+            rows = rows_to_csv(dimensions[table], header=TABLES[table])
+            with zipfile.ZipFile(os.path.join(output_dir, f'{table}.csv.zip'), 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr(f'{table}.csv', rows.getvalue())
+        parts_dir = tempfile.mkdtemp(prefix='instacart-parts-', dir=output_dir)
+
+    tasks = [(seed, index, first, last) for index, first, last in chunk_ranges(num_users)]
+    totals = dict.fromkeys(FACT_TABLES, 0)
+    try:
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(seed, target, dsn, parts_dir)) as pool:
+            for done, (chunk_index, counts) in enumerate(pool.imap_unordered(_generate_chunk, tasks), start=1):
+                for table, count in counts.items():
+                    totals[table] += count
+                if done % 10 == 0 or done == len(tasks):
+                    logger.info(f'{done}/{len(tasks)} chunks, {sum(totals.values()):,} rows '
+                                f'({time.monotonic() - started:.0f}s)')
+            # Let the workers exit normally so that they close their connections
+            pool.close()
+            pool.join()
+
+        if target == 'zip':
+            for table in FACT_TABLES:
+                parts = [os.path.join(parts_dir, f'{table}.{index:08d}.csv') for _, index, _, _ in tasks]
+                write_zip(output_dir, table, TABLES[table], parts)
+    finally:
+        if parts_dir:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+
+    for table in DIMENSION_TABLES:
+        totals[table] = len(dimensions[table])
+    logger.info(f'Generated {sum(totals.values()):,} rows in {time.monotonic() - started:.1f}s: {totals}')
+    return totals
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic Instacart data at a chosen scale.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiple of the Kaggle extract volume (users, orders, order_products)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--target', choices=['postgres', 'zip'], default='zip')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help='Directory for the zipped CSVs (zip target)')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Replace zipped CSVs already present in the output directory (zip target)')
+    parser.add_argument('--dsn', default=None,
+                        help='libpq connection string (postgres target). Defaults to the DBT_POSTGRES_* variables')
+    parser.add_argument('--create', action='store_true',
+                        help=f'Create the {RAW_SCHEMA} tables if missing and truncate them first (postgres target)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    args = parse_args(argv)
+    generate(args.scale, args.seed, args.target, args.workers,
+             output_dir=args.output_dir, dsn=args.dsn or default_dsn(), create=args.create,
+             overwrite=args.overwrite)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,8 @@ export AIRFLOW__WEBSERVER__SECRET_KEY
 DBT_POSTGRESQL_CONN="postgresql+psycopg2://${DBT_POSTGRES_USER}:${DBT_POSTGRES_PASSWORD}@${DBT_POSTGRES_HOST}:${POSTGRES_PORT}/${DBT_POSTGRES_DB}"
 
 cd /dbt && dbt compile
+# Warm dbt workers for DbtRunOperator. Tasks fall back to the dbt CLI if this is not running.
+python /airflow/plugins/dbt_runner_pool.py --workers ${DBT_RUNNER_POOL_WORKERS:-4} &
 rm -f /airflow/airflow-webserver.pid
 
 airflow users create --username airflow_admin --firstname admin --lastname admin --role Admin --email admin2 --password admin
@@ -17,4 +19,5 @@ sleep 10
 airflow db upgrade
 sleep 10
 airflow connections add 'dbt_postgres_instance_raw_data' --conn-uri $DBT_POSTGRESQL_CONN
-airflow scheduler & airflow webserver
+# The triggerer runs deferred tasks, e.g. AuditEventSensor
+airflow scheduler & airflow triggerer & airflow webserver
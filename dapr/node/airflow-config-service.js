@@ -53,6 +53,21 @@ const getDatasetConfig = async (dataset) => {
   };
 };
 
+// Mock dataset catalog: every domain is onboarded at each layer
+const DATASET_DOMAINS = ['transactions', 'orders', 'order_products', 'customers', 'products', 'aisles',
+  'departments', 'inventory', 'payments', 'shipments', 'returns', 'promotions'];
+const DATASET_LAYERS = ['raw', 'clean', 'curated'];
+
+const listDatasets = async () => {
+  return DATASET_DOMAINS.flatMap(domain => DATASET_LAYERS.map(layer => `${domain}_${layer}`));
+};
+
+// Glob pattern (* and ?) to an anchored regular expression
+const globToRegExp = (glob) => {
+  const escaped = glob.trim().replace(/[.+^${}()|[\]\\]/g, '\\$&');
+  return new RegExp(`^${escaped.replace(/\*/g, '.*').replace(/\?/g, '.')}$`);
+};
+
 // Get process config endpoint
 app.get('/config', async (req, res) => {
   try {
@@ -91,6 +106,23 @@ app.get('/datasetConfig', async (req, res) => {
   }
 });
 
+// List datasets, optionally filtered by comma-separated names or glob patterns, e.g. ?pattern=orders_*,transactions_raw
+app.get('/datasets', async (req, res) => {
+  const { pattern } = req.query;
+  try {
+    let datasets = await listDatasets();
+    if (pattern) {
+      const matchers = pattern.split(',').filter(p => p.trim()).map(globToRegExp);
+      datasets = datasets.filter(dataset => matchers.some(matcher => matcher.test(dataset)));
+    }
+    configRequestCounter.inc({ config_type: 'datasets' });
+    res.status(200).json(datasets);
+  } catch (error) {
+    console.error('Error listing datasets:', error);
+    res.status(500).json({ message: 'Failed to list datasets', error: error.message });
+  }
+});
+
 // Prometheus metrics endpoint
 app.get('/metrics', async (req, res) => {
   res.set('Content-Type', register.contentType);
@@ -9,6 +9,10 @@ app.use(bodyParser.json());
 const daprPort = process.env.DAPR_HTTP_PORT || 3500;
 const stateStoreName = `statestore`;
 const stateUrl = `http://localhost:${daprPort}/v1.0/state/${stateStoreName}`;
+// Recorded events are also published, so consumers (e.g. the Airflow AuditEventSensor) need not poll
+const pubsubName = `pubsub`;
+const eventsTopic = `audit-events`;
+const publishUrl = `http://localhost:${daprPort}/v1.0/publish/${pubsubName}/${eventsTopic}`;
 const port = 3000;
 
 // Prometheus setup
@@ -43,6 +47,20 @@ app.post('/recordEvent', async (req, res) => {
       throw new Error(`HTTP error! status: ${response.status}`);
     }
 
+    // The state store is the record of the event: a failed publish is logged but does not fail the request
+    try {
+      const publishResponse = await fetch(publishUrl, {
+        method: 'POST',
+        body: JSON.stringify(eventData),
+        headers: { 'Content-Type': 'application/json' }
+      });
+      if (!publishResponse.ok) {
+        throw new Error(`HTTP error! status: ${publishResponse.status}`);
+      }
+    } catch (error) {
+      console.error(`Error publishing event to ${eventsTopic}:`, error);
+    }
+
     eventCounter.inc({ event_type: eventData.status });
     res.status(200).json({ message: 'Event recorded successfully', event: eventData });
   } catch (error) {
@@ -0,0 +1,129 @@
+"""Read the dbt model outputs from postgres-dbt for the Streamlit app.
+
+One Analytics instance is shared by every Streamlit session (app.py keeps it
+in st.cache_resource). It holds a thread-safe connection pool and caches each
+result until its model is rebuilt. The results are small (TOP_N rows, or one
+row per day) and are kept whole in the cache, so they are fetched in one go.
+
+A model's version is its last successful build time, read from the run state
+that DbtRunOperator writes (`./dbt/target/run_state`, mounted read-only). When
+there is no run state for a model, a fingerprint of its table from
+pg_class / pg_stat_user_tables is used instead: dbt re-creates the table on
+every build, and any write changes the tuple counters.
+"""
+import json
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+
+SCHEMA = os.environ.get('DBT_DBT_SCHEMA', 'dbt')
+RUN_STATE_DIR = os.environ.get('DBT_RUN_STATE_DIR', '/run_state')
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 8
+
+FINGERPRINT_SQL = """
+    select c.oid::bigint, coalesce(s.n_tup_ins, 0), coalesce(s.n_tup_upd, 0), coalesce(s.n_tup_del, 0)
+    from pg_class c
+    join pg_namespace n on n.oid = c.relnamespace
+    left join pg_stat_user_tables s on s.relid = c.oid
+    where n.nspname = %s and c.relname = %s
+"""
+
+TOP_N = 10  # rows of the top_selling_* views
+
+TOP_SELLING = {
+    'products': 'product_name',
+    'aisles': 'aisle',
+    'departments': 'department',
+}
+
+
+def default_dsn():
+    return (f"host={os.environ.get('DBT_POSTGRES_HOST', 'postgres-dbt')} "
+            f"port={os.environ.get('DBT_POSTGRES_PORT', '5432')} "
+            f"dbname={os.environ.get('DBT_POSTGRES_DB', 'dbtdb')} "
+            f"user={os.environ.get('DBT_POSTGRES_USER', 'dbtuser')} "
+            f"password={os.environ.get('DBT_POSTGRES_PASSWORD', 'pssd')} "
+            f"application_name=pythonapp")
+
+
+class Analytics:
+
+    def __init__(self, dsn=None, pool=None, schema=SCHEMA, state_dir=RUN_STATE_DIR):
+        self.pool = pool or ThreadedConnectionPool(MIN_CONNECTIONS, MAX_CONNECTIONS, dsn or default_dsn())
+        self.schema = schema
+        self.state_dir = state_dir
+        self._results = {}  # (model, view, params) -> (version, DataFrame)
+        self._locks = defaultdict(threading.Lock)
+        self._locks_lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection. Its transaction is rolled back before it is returned."""
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            broken = conn.closed
+            if not broken:
+                conn.rollback()
+            self.pool.putconn(conn, close=bool(broken))
+
+    def model_version(self, model):
+        try:
+            with open(os.path.join(self.state_dir, f'{model}.json')) as handle:
+                return ('built_at', json.load(handle)['built_at'])
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(FINGERPRINT_SQL, (self.schema, model))
+            row = cursor.fetchone()
+        return ('fingerprint', tuple(row) if row else None)
+
+    def fetch(self, query, params=None):
+        """Run a query on a pooled connection and return its result as a DataFrame."""
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(query, params)
+            columns = [column.name for column in cursor.description]
+            return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+    def read(self, model, view, query, params=None):
+        """Return the result of a query over a model, cached until the model is rebuilt.
+
+        view names the query in the cache. Returns (DataFrame, cache_hit).
+        Concurrent sessions asking for the same result wait for a single query
+        instead of each running it.
+        """
+        key = (model, view, tuple(params or ()))
+        version = self.model_version(model)
+        with self._locks_lock:
+            lock = self._locks[key]
+        with lock:
+            cached = self._results.get(key)
+            if cached and cached[0] == version:
+                return cached[1], True
+            df = self.fetch(query, params)
+            self._results[key] = (version, df)
+            return df, False
+
+    def table(self, model):
+        return sql.SQL('{}.{}').format(sql.Identifier(self.schema), sql.Identifier(model))
+
+    def top_selling(self, kind):
+        """Top TOP_N products, aisles or departments by number of orders."""
+        model = f'top_selling_{kind}'
+        query = sql.SQL('select {}, number_of_orders from {} order by number_of_orders desc limit %s').format(
+            sql.Identifier(TOP_SELLING[kind]), self.table(model))
+        return self.read(model, 'top_selling', query, (TOP_N,))
+
+    def daily_orders_7_day_avg(self, start=None, end=None):
+        """Daily orders with their 7 day rolling average, for dt in [start, end)."""
+        query = sql.SQL('select dt, daily_orders_count, rolling_7_day_avg from {} '
+                        'where dt >= coalesce(%s::date, \'-infinity\') and dt < coalesce(%s::date, \'infinity\') '
+                        'order by dt').format(self.table('daily_orders_7_day_avg'))
+        return self.read('daily_orders_7_day_avg', 'daily', query, (start, end))
@@ -2,104 +2,119 @@ import json
 import logging
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
 from datetime import datetime
 
 import pandas as pd
 import plotly.graph_objects as go
+import psycopg2
 import requests
 import streamlit as st
-from opentelemetry import trace
-from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import \
-    OTLPSpanExporter
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.sdk.resources import Resource
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import (BatchSpanProcessor,
-                                            ConsoleSpanExporter)
-from opentelemetry.semconv.resource import ResourceAttributes
-from prometheus_client import CollectorRegistry, Counter, start_http_server
+
+import analytics
+import exports
+from resilience import CircuitOpenError, call_with_budget, get_breaker, get_hedge_pool, hedged
+from telemetry import get_telemetry
 
 # Dapr configuration
 dapr_port = 3500
 base_url = f"http://localhost:{dapr_port}/v1.0/invoke"
 
+# Resilience of service calls
+REQUEST_BUDGET = 5  # seconds, total time one call_endpoint may take including retries
+ATTEMPT_TIMEOUT = 2  # seconds, per attempt of a retried GET
+HEDGE_DELAY = 0.3  # seconds before a second copy of an idempotent GET is sent, None to turn hedging off
+BREAKER_FAILURE_THRESHOLD = 3  # consecutive failures that open a service's circuit
+BREAKER_RESET_TIMEOUT = 30  # seconds an open circuit waits before a probe call
+IDEMPOTENT_METHODS = {'config', 'datasets', 'datasetConfig', 'dagConfig', 'getLineage', 'getEvents'}
+
+# Charts of the dbt models: model -> (chart, x, y)
+MODEL_CHARTS = {
+    'top_selling_products': ('bar', 'product_name', 'number_of_orders'),
+    'top_selling_aisles': ('bar', 'aisle', 'number_of_orders'),
+    'top_selling_departments': ('bar', 'department', 'number_of_orders'),
+    'avg_product_count_by_dow': ('bar', 'order_dow', 'avg_product_count'),
+    'daily_orders_7_day_avg': ('line', 'dt', ['daily_orders_count', 'rolling_7_day_avg']),
+}
+
+# Batch runs
+BATCH_MAX_WORKERS = 16  # upper bound of the Workers input of the Batch Run page
+# Threads for hedged GETs: a request and its hedge for every batch pipeline thread, plus the page's own calls
+HEDGE_WORKERS = 2 * (BATCH_MAX_WORKERS + 1)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Set up OpenTelemetry tracing
-def setup_opentelemetry():
-    resource = Resource(attributes={
-        ResourceAttributes.SERVICE_NAME: "pythonapp"
-    })
-
-    trace.set_tracer_provider(TracerProvider(resource=resource))
-    tracer = trace.get_tracer(__name__)
-
-    max_retries = 5
-    retry_delay = 5  # seconds
-
-    for attempt in range(max_retries):
-        try:
-            otlp_exporter = OTLPSpanExporter(
-                endpoint="http://127.0.0.1:4317",
-                insecure=True
-            )
-            span_processor = BatchSpanProcessor(otlp_exporter)
-            trace.get_tracer_provider().add_span_processor(span_processor)
-            logger.info("Successfully connected to OpenTelemetry Collector")
-            break
-        except Exception as e:
-            if attempt < max_retries - 1:
-                logger.warning(f"Failed to connect to OpenTelemetry Collector. Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                logger.error("Failed to connect to OpenTelemetry Collector after multiple attempts")
-                # Fallback to Console exporter if OTLP exporter fails
-                console_exporter = ConsoleSpanExporter()
-                console_span_processor = BatchSpanProcessor(console_exporter)
-                trace.get_tracer_provider().add_span_processor(console_span_processor)
-                logger.info("Falling back to Console exporter")
-
-    return tracer
-
-tracer = setup_opentelemetry()
-
-# Instrument the requests library
-RequestsInstrumentor().instrument()
-
-# Set up Prometheus metrics
-registry = CollectorRegistry()
-REQUEST_COUNT = Counter('request_count', 'Total number of requests', registry=registry)
-
-# Start the Prometheus HTTP server
-try:
-    start_http_server(port=9092, addr='0.0.0.0', registry=registry)
-    logger.info("Started Prometheus HTTP server on port 9092")
-except OSError as e:
-    if e.errno == 98:  # Address already in use
-        logger.info("Prometheus HTTP server already running on port 9092")
-    else:
-        logger.error(f"Failed to start Prometheus HTTP server: {e}")
+# Tracing, instrumentation and the metrics server are set up once per process,
+# not on every Streamlit rerun
+telemetry = get_telemetry()
+tracer = telemetry.tracer
+registry = telemetry.registry
+REQUEST_COUNT = telemetry.request_count
 
 # Use the metrics in your Streamlit app
 def increment_request_counter():
     REQUEST_COUNT.inc()
 
-# Call this function at the beginning of your Streamlit app
-increment_request_counter()
+class PipelineError(Exception):
+    pass
+
+def send_request(url, http_method, data, timeout):
+    if http_method == 'GET':
+        response = requests.get(url, params=data, timeout=timeout)
+    elif http_method == 'POST':
+        response = requests.post(url, json=data, timeout=timeout)
+    response.raise_for_status()
+    return response
+
+def is_service_failure(e):
+    """Timeouts, connection errors and 5xx count against the circuit breaker and are retried; 4xx are not."""
+    response = getattr(e, 'response', None)
+    return response is None or response.status_code >= 500
 
-def call_endpoint(service_name, method_name, http_method='GET', data=None):
+def call_endpoint(service_name, method_name, http_method='GET', data=None, show_errors=True):
+    """Call a service method through Dapr. Returns None on failure.
+
+    With show_errors=False nothing is written to the Streamlit page, which is
+    required when calling from a worker thread.
+    """
     with tracer.start_as_current_span(f"call_endpoint_{service_name}_{method_name}"):
         url = f"{base_url}/{service_name}/method/{method_name}"
+        increment_request_counter()
+        breaker = get_breaker(service_name, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                              reset_timeout=BREAKER_RESET_TIMEOUT)
+        telemetry.requests_in_flight.labels(service_name, method_name).inc()
+        started = time.perf_counter()
+        status = 'error'  # No HTTP response received
         try:
+            if not breaker.allow_request():
+                status = 'circuit_open'
+                raise CircuitOpenError(f"Circuit for {service_name} is open, retrying in {breaker.retry_after():.0f}s")
             logger.info(f"Calling endpoint: {url}")
-            if http_method == 'GET':
-                response = requests.get(url, params=data, timeout=5)
-            elif http_method == 'POST':
-                response = requests.post(url, json=data, timeout=5)
-            response.raise_for_status()
+            send = lambda timeout: send_request(url, http_method, data, timeout)
+            if http_method == 'GET' and method_name in IDEMPOTENT_METHODS:
+                send_hedged = hedged(send, HEDGE_DELAY, get_hedge_pool(HEDGE_WORKERS))
+                response = call_with_budget(send_hedged, REQUEST_BUDGET, ATTEMPT_TIMEOUT, retryable=is_service_failure)
+            else:
+                response = send(REQUEST_BUDGET)
+            status = str(response.status_code)
+            breaker.record_success()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except CircuitOpenError as e:
+            telemetry.request_errors.labels(service_name, method_name, status).inc()
+            logger.warning(f"Skipped {service_name}/{method_name}: {e}")
+            if show_errors:
+                st.warning(f"Skipped {service_name}/{method_name}: {e}")
+            return None
+        except (requests.exceptions.RequestException, TimeoutError) as e:
+            if getattr(e, 'response', None) is not None:
+                status = str(e.response.status_code)
+            if is_service_failure(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            telemetry.request_errors.labels(service_name, method_name, status).inc()
             logger.error(f"Error calling {service_name}/{method_name}: {e}")
             logger.error(f"URL: {url}")
             logger.error(f"Method: {http_method}")
@@ -108,16 +123,23 @@ def call_endpoint(service_name, method_name, http_method='GET', data=None):
                 logger.error(f"Response status code: {e.response.status_code}")
                 logger.error(f"Response headers: {e.response.headers}")
                 logger.error(f"Response text: {e.response.text}")
-            st.error(f"Error calling {service_name}/{method_name}: {e}")
-            st.error(f"URL: {url}")
-            st.error(f"Method: {http_method}")
-            st.error(f"Data: {data}")
+            if show_errors:
+                st.error(f"Error calling {service_name}/{method_name}: {e}")
+                st.error(f"URL: {url}")
+                st.error(f"Method: {http_method}")
+                st.error(f"Data: {data}")
             return None
+        finally:
+            telemetry.requests_in_flight.labels(service_name, method_name).dec()
+            telemetry.observe_request(service_name, method_name, status, time.perf_counter() - started)
 
-def generate_correlation_id():
-    return call_endpoint('management-service', 'generateCorrelationId')['correlationId']
+def generate_correlation_id(show_errors=True):
+    response = call_endpoint('management-service', 'generateCorrelationId', show_errors=show_errors)
+    if response is None:
+        raise PipelineError("Failed to generate a correlation ID")
+    return response['correlationId']
 
-def record_event(event_type, details, dataset, process_start_time, correlation_id):
+def send_event(event_type, details, dataset, process_start_time, correlation_id, show_errors=True):
     event_data = {
         'status': event_type,
         'pipeline': 'data_engineering_pipeline',
@@ -127,7 +149,10 @@ def record_event(event_type, details, dataset, process_start_time, correlation_i
         'correlationId': correlation_id,
         **details
     }
-    recorded_event = call_endpoint('audit-service', 'recordEvent', http_method='POST', data=event_data)
+    return call_endpoint('audit-service', 'recordEvent', http_method='POST', data=event_data, show_errors=show_errors)
+
+def record_event(event_type, details, dataset, process_start_time, correlation_id):
+    recorded_event = send_event(event_type, details, dataset, process_start_time, correlation_id)
     if recorded_event:
         st.success(f"Event recorded: {event_type}")
         with st.expander(f"{event_type.capitalize()} Event", expanded=False):
@@ -189,7 +214,11 @@ def simulate_data_processing(dataset_config):
 def data_engineering_pipeline():
     with tracer.start_as_current_span("data_engineering_pipeline"):
         # Generate a correlation ID at the start of processing
-        correlation_id = generate_correlation_id()
+        try:
+            correlation_id = generate_correlation_id()
+        except PipelineError as e:
+            st.error(f"{e}. Exiting pipeline.")
+            return
         st.info(f"Correlation ID for this run: {correlation_id}")
 
         # Add a progress bar for pipeline execution
@@ -238,6 +267,7 @@ def data_engineering_pipeline():
 
         dag_conf = {
             'dataset': dataset,
+            'correlation_id': correlation_id,
             'processed_at': datetime.now().isoformat(),
             'rows_processed': 0  # Placeholder, will be updated after processing
         }
@@ -303,6 +333,160 @@ def data_engineering_pipeline():
 
         return correlation_id
 
+def run_pipeline(dataset):
+    """Run the pipeline steps of one dataset without any Streamlit output.
+
+    This is the headless counterpart of data_engineering_pipeline, safe to run
+    on a worker thread. Failures are returned in the result, not raised.
+    """
+    started = time.perf_counter()
+    result = {'dataset': dataset, 'correlation_id': None, 'status': 'failed', 'rows_processed': 0, 'error': None}
+    with tracer.start_as_current_span("data_engineering_pipeline", attributes={'dataset': dataset}):
+        process_start_time = datetime.now().isoformat()
+        try:
+            correlation_id = result['correlation_id'] = generate_correlation_id(show_errors=False)
+
+            dataset_config = call_endpoint('airflow-config-service', 'datasetConfig', data={'dataset': dataset}, show_errors=False)
+            if dataset_config is None:
+                raise PipelineError(f"Failed to get dataset configuration for {dataset}")
+            send_event('start', {'dataset': dataset}, dataset, process_start_time, correlation_id, show_errors=False)
+
+            dag_id = 'dag_'+dataset
+            dag_config = call_endpoint('airflow-config-service', 'dagConfig', data={'dagId': dag_id}, show_errors=False)
+            send_event('dag_config_retrieved', {'dag_id': dag_id, 'dag_config': dag_config},
+                       dataset, process_start_time, correlation_id, show_errors=False)
+            dag_conf = {
+                'dataset': dataset,
+                'correlation_id': correlation_id,
+                'processed_at': datetime.now().isoformat(),
+                'rows_processed': 0
+            }
+            dag_trigger_response = call_endpoint('airflow-trigger-service', 'triggerDag', http_method='POST',
+                                                 data={'dagId': dag_id, 'conf': dag_conf}, show_errors=False)
+            send_event('dag_triggered', {'dag_id': dag_id, 'dag_conf': dag_conf, 'dag_trigger_response': dag_trigger_response},
+                       dataset, process_start_time, correlation_id, show_errors=False)
+
+            # Simulate data processing
+            time.sleep(random.uniform(0.5, 5.0))
+            processed_rows = random.randint(1000, 1000000)
+
+            lineage_data = {
+                'input': dataset_config['source'],
+                'output': dataset_config['destination'],
+                'transformation': 'data_engineering_pipeline',
+                'rows_processed': processed_rows
+            }
+            call_endpoint('lineage-service', 'recordLineage', http_method='POST',
+                          data={'dataset': dataset, 'lineageData': lineage_data}, show_errors=False)
+            send_event('lineage_recorded', {'dataset': dataset, 'lineage_data': lineage_data},
+                       dataset, process_start_time, correlation_id, show_errors=False)
+            call_endpoint('lineage-service', 'getLineage', data={'dataset': dataset_config['destination']}, show_errors=False)
+
+            send_event('end', {'result': 'success', 'rows_processed': processed_rows, 'dataset': dataset},
+                       dataset, process_start_time, correlation_id, show_errors=False)
+            result.update(status='success', rows_processed=processed_rows)
+        except Exception as e:
+            logger.error(f"Pipeline for {dataset} failed: {e}")
+            result['error'] = str(e)
+            if result['correlation_id']:
+                send_event('end', {'result': 'failed', 'error': str(e), 'dataset': dataset},
+                           dataset, process_start_time, result['correlation_id'], show_errors=False)
+    result['duration'] = time.perf_counter() - started
+    return result
+
+def run_batch(datasets, max_workers, on_progress=None):
+    """Run the pipeline of each dataset on a bounded pool of worker threads.
+
+    on_progress(results, elapsed) is called on the calling thread each time a
+    pipeline completes, so it may update the Streamlit page.
+    """
+    results = []
+    started = time.perf_counter()
+    with tracer.start_as_current_span("data_engineering_batch", attributes={'datasets': len(datasets)}):
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipeline') as executor:
+            # Each pipeline runs in a copy of this context so its span is a child of the batch span
+            futures = [executor.submit(copy_context().run, run_pipeline, dataset) for dataset in datasets]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if on_progress:
+                    on_progress(results, time.perf_counter() - started)
+    return results
+
+def data_engineering_batch(pattern, max_workers):
+    datasets = call_endpoint('airflow-config-service', 'datasets', data={'pattern': pattern})
+    if not datasets:
+        st.warning(f"No datasets match {pattern!r}.")
+        return None
+
+    st.write(f"Running {len(datasets)} pipelines on {max_workers} workers...")
+    progress_bar = st.progress(0)
+    metrics = st.empty()
+
+    def show_progress(results, elapsed):
+        failed = sum(1 for r in results if r['status'] != 'success')
+        progress_bar.progress(len(results) / len(datasets), text=f"{len(results)}/{len(datasets)} datasets")
+        with metrics.container():
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Completed", f"{len(results)}/{len(datasets)}")
+            m2.metric("Failed", failed)
+            m3.metric("Throughput", f"{len(results) / elapsed * 60:.1f} datasets/min")
+            m4.metric("Rows processed", f"{sum(r['rows_processed'] for r in results):,}")
+
+    results = run_batch(datasets, max_workers, on_progress=show_progress)
+    st.dataframe(pd.DataFrame(results).sort_values('dataset'), use_container_width=True, hide_index=True)
+    return results
+
+@st.cache_data(show_spinner=False)
+def load_export(model, mtime):
+    """Read a model export. mtime is part of the cache key, so a new export is read again."""
+    return exports.read_export(model).to_pandas()
+
+@st.cache_resource
+def get_analytics():
+    """One connection pool and result cache for postgres-dbt, shared by all sessions."""
+    return analytics.Analytics()
+
+def query_model(model):
+    db = get_analytics()
+    if model == 'daily_orders_7_day_avg':
+        return db.daily_orders_7_day_avg()
+    if model.startswith('top_selling_'):
+        return db.top_selling(model[len('top_selling_'):])
+    return None, False
+
+def load_model(model, source):
+    """Return (DataFrame, caption) of a model from its Parquet export or the live database. The DataFrame is None if unavailable."""
+    if source == 'Parquet export':
+        mtime = exports.export_mtime(model)
+        if mtime is None:
+            return None, f"{model} has not been exported yet. It is exported after each run of its DAG."
+        return load_export(model, mtime), f"Parquet export of {datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M:%S}"
+    try:
+        df, cache_hit = query_model(model)
+    except psycopg2.Error as e:
+        logger.error(f"Error querying {model}: {e}")
+        return None, f"Failed to query {model}: {e}"
+    if df is None:
+        return None, f"{model} is only available from its Parquet export."
+    return df, f"Live from postgres-dbt, {'cached since the last build' if cache_hit else 'queried after a new build'}"
+
+def show_model(model, source):
+    df, caption = load_model(model, source)
+    if df is None:
+        st.info(caption)
+        return
+    chart, x, y = MODEL_CHARTS[model]
+    if 'dt' in df.columns:
+        df = df.assign(month=pd.to_datetime(df['dt']).dt.strftime('%Y-%m'))
+        month = st.selectbox("Month", ['All'] + sorted(df['month'].unique()), index=0)
+        if month != 'All':
+            df = df[df['month'] == month]
+    if chart == 'line':
+        st.line_chart(df.sort_values(x), x=x, y=y, use_container_width=True)
+    else:
+        st.bar_chart(df, x=x, y=y, use_container_width=True)
+    st.caption(f"{len(df):,} rows. {caption}")
+
 # Streamlit app
 st.set_page_config(page_title="Data Engineering Pipeline", layout="wide")
 
@@ -328,8 +512,21 @@ with col1:
     if st.button("🏁 Start Data Engineering Pipeline"):
         st.write("Starting Data Engineering Pipeline...")
         correlation_id = data_engineering_pipeline()
-        st.success(f"Pipeline completed successfully! Correlation ID: {correlation_id}")
-        st.info("Use this Correlation ID to retrieve event logs for this run.")
+        if correlation_id:
+            st.success(f"Pipeline completed successfully! Correlation ID: {correlation_id}")
+            st.info("Use this Correlation ID to retrieve event logs for this run.")
+
+    st.subheader("🗂️ Batch Run")
+    batch_pattern = st.text_input("Datasets (names or glob patterns, comma separated)", "*_raw")
+    batch_workers = st.number_input("Workers", min_value=1, max_value=BATCH_MAX_WORKERS, value=4)
+    if st.button("🏁 Start Batch"):
+        results = data_engineering_batch(batch_pattern, int(batch_workers))
+        if results:
+            failed = [r['dataset'] for r in results if r['status'] != 'success']
+            if failed:
+                st.error(f"{len(failed)} of {len(results)} pipelines failed: {', '.join(sorted(failed))}")
+            else:
+                st.success(f"All {len(results)} pipelines completed successfully.")
 
     st.subheader("📊 Audit Logs")
     dataset = st.text_input("Dataset", "transactions_raw")
@@ -377,6 +574,11 @@ with col1:
             else:
                 st.warning("Please provide both Dataset and Correlation ID")
 
+    st.subheader("📈 dbt Models")
+    model_source = st.radio("Source", ['Parquet export', 'Live database'], horizontal=True)
+    model = st.selectbox("Model", list(MODEL_CHARTS))
+    show_model(model, model_source)
+
 with col2:
     st.header("⚙️ Configuration")
     if st.button("Get Process Config"):
@@ -0,0 +1,35 @@
+"""Read the Parquet exports of the dbt models (see airflow/plugins/parquet_export.py).
+
+Files are memory-mapped, so reading an export does not copy it into memory
+before Arrow needs the pages, and no query reaches postgres-dbt.
+"""
+import json
+import os
+
+import pyarrow.parquet as pq
+
+EXPORT_DIR = os.environ.get('EXPORT_DIR', '/exports')
+MANIFEST_FILE = '_export.json'
+
+
+def export_path(model, export_dir=EXPORT_DIR):
+    return os.path.join(export_dir, model)
+
+
+def export_mtime(model, export_dir=EXPORT_DIR):
+    """Modification time of the export's manifest, rewritten by every export. None if not exported yet."""
+    try:
+        return os.stat(os.path.join(export_path(model, export_dir), MANIFEST_FILE)).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(model, export_dir=EXPORT_DIR):
+    with open(os.path.join(export_path(model, export_dir), MANIFEST_FILE)) as handle:
+        return json.load(handle)
+
+
+def read_export(model, export_dir=EXPORT_DIR, columns=None, filters=None):
+    """Read an export as an Arrow table. Hive partition columns (e.g. `month`) are read back as columns."""
+    return pq.read_table(export_path(model, export_dir), columns=columns, filters=filters,
+                         memory_map=True, partitioning='hive')
@@ -0,0 +1,298 @@
+"""Asyncio load driver for the Dapr services.
+
+Replays the mix of calls made by `data_engineering_pipeline` in app.py at a
+target request rate, either through the Dapr HTTP port or against a local
+stand-in server, and reports latency percentiles, error rate and throughput
+per method.
+
+Examples:
+    # Through the pythonapp sidecar, 50 requests/s for a minute
+    python loadtest.py --rps 50 --duration 60 --output run.json
+
+    # Against the built-in stand-in server, compared with a previous run
+    python loadtest.py --stub --rps 200 --duration 30 --compare run.json
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import aiohttp
+from aiohttp import web
+
+# Dapr configuration
+dapr_port = 3500
+base_url = f"http://localhost:{dapr_port}/v1.0/invoke"
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (service, method, http method, calls per pipeline run)
+# Mirrors the calls made by one run of data_engineering_pipeline in app.py.
+PIPELINE_CALL_MIX = [
+    ('management-service', 'generateCorrelationId', 'GET', 1),
+    ('airflow-config-service', 'config', 'GET', 1),
+    ('airflow-config-service', 'datasetConfig', 'GET', 1),
+    ('airflow-config-service', 'dagConfig', 'GET', 1),
+    ('audit-service', 'recordEvent', 'POST', 5),
+    ('airflow-trigger-service', 'triggerDag', 'POST', 1),
+    ('lineage-service', 'recordLineage', 'POST', 1),
+    ('lineage-service', 'getLineage', 'GET', 1),
+]
+
+PERCENTILES = (50, 95, 99)
+
+
+def build_payload(service, method, rng):
+    """Return request data resembling what app.py sends for the given method."""
+    dataset = f"transactions_raw_{rng.randint(1, 100)}"
+    correlation_id = f"corr-loadtest-{rng.getrandbits(32):08x}"
+    if method == 'datasetConfig' or method == 'getLineage':
+        return {'dataset': dataset}
+    if method == 'dagConfig':
+        return {'dagId': f"dag_{dataset}"}
+    if method == 'recordEvent':
+        return {
+            'status': rng.choice(['start', 'dag_config_retrieved', 'dag_triggered', 'lineage_recorded', 'end']),
+            'pipeline': 'data_engineering_pipeline',
+            'timestamp': datetime.now().isoformat(),
+            'dataset': dataset,
+            'process_start_time': datetime.now().isoformat(),
+            'correlationId': correlation_id,
+        }
+    if method == 'triggerDag':
+        return {'dagId': f"dag_{dataset}", 'conf': {'dataset': dataset, 'rows_processed': 0}}
+    if method == 'recordLineage':
+        return {'dataset': dataset, 'lineageData': {
+            'input': 's3://data-lake/raw/',
+            'output': 's3://data-warehouse/processed/',
+            'transformation': 'data_engineering_pipeline',
+            'rows_processed': rng.randint(1000, 1000000),
+        }}
+    return None
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarise(samples, duration):
+    """Aggregate (service, method, status, latency_seconds) samples per method.
+
+    `status` is the HTTP status code, or the exception class name when no
+    response was received.
+    """
+    grouped = defaultdict(list)
+    for service, method, status, latency in samples:
+        grouped[f"{service}/{method}"].append((status, latency))
+    grouped['ALL'] = [(status, latency) for _, _, status, latency in samples]
+
+    summary = {}
+    for key, results in sorted(grouped.items()):
+        latencies = sorted(latency for _, latency in results)
+        errors = sum(1 for status, _ in results if not (isinstance(status, int) and status < 400))
+        statuses = defaultdict(int)
+        for status, _ in results:
+            statuses[str(status)] += 1
+        summary[key] = {
+            'requests': len(results),
+            'errors': errors,
+            'error_rate': errors / len(results) if results else 0.0,
+            'throughput_rps': len(results) / duration if duration else 0.0,
+            'mean_ms': 1000 * sum(latencies) / len(latencies) if latencies else None,
+            'max_ms': 1000 * latencies[-1] if latencies else None,
+            'statuses': dict(statuses),
+        }
+        for pct in PERCENTILES:
+            value = percentile(latencies, pct)
+            summary[key][f'p{pct}_ms'] = 1000 * value if value is not None else None
+    return summary
+
+
+def compare(current, baseline):
+    """Return per-method relative changes of p50/p95/p99, error rate and throughput."""
+    deltas = {}
+    for key, stats in current.items():
+        if key not in baseline:
+            continue
+        deltas[key] = {}
+        for metric in [f'p{pct}_ms' for pct in PERCENTILES] + ['error_rate', 'throughput_rps']:
+            new, old = stats.get(metric), baseline[key].get(metric)
+            if new is None or old is None:
+                continue
+            deltas[key][metric] = (new - old) / old if old else None
+    return deltas
+
+
+async def call(session, base, service, method, http_method, data, timeout):
+    url = f"{base}/{service}/method/{method}"
+    if http_method == 'GET':
+        request = session.get(url, params=data, timeout=timeout)
+    else:
+        request = session.post(url, json=data, timeout=timeout)
+    async with request as response:
+        await response.read()
+        return response.status
+
+
+async def run_load(base, rps, duration, concurrency=100, timeout=5, seed=None, call_mix=PIPELINE_CALL_MIX):
+    """Issue requests at a fixed rate for `duration` seconds and return the raw samples.
+
+    The schedule is open-loop: latency is measured from the time a request was
+    due, so a slow server cannot hide queueing delay by slowing the driver down.
+    """
+    rng = random.Random(seed)
+    population = [(service, method, http_method) for service, method, http_method, _ in call_mix]
+    weights = [weight for _, _, _, weight in call_mix]
+    total = int(rps * duration)
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def one(service, method, http_method, data, due):
+        async with semaphore:
+            try:
+                status = await call(session, base, service, method, http_method, data, client_timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+            samples.append((service, method, status, time.monotonic() - due))
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.monotonic()
+        tasks = []
+        for i in range(total):
+            due = started + i / rps
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            service, method, http_method = rng.choices(population, weights=weights)[0]
+            data = build_payload(service, method, rng)
+            tasks.append(asyncio.create_task(one(service, method, http_method, data, due)))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+    return samples, elapsed
+
+
+def stub_app(latency_ms=5.0, jitter_ms=5.0, error_rate=0.0):
+    """A stand-in for the Dapr sidecar that answers every invoke route locally."""
+    async def handler(request):
+        await asyncio.sleep((latency_ms + random.random() * jitter_ms) / 1000)
+        if random.random() < error_rate:
+            return web.json_response({'message': 'stub failure'}, status=500)
+        method = request.match_info['method']
+        if method == 'generateCorrelationId':
+            return web.json_response({'correlationId': f"corr-{int(time.time() * 1000)}"})
+        if request.method == 'POST':
+            return web.json_response({'message': 'ok', 'data': await request.json()})
+        return web.json_response({'method': method, **request.query})
+
+    app = web.Application()
+    app.router.add_route('*', '/v1.0/invoke/{service}/method/{method}', handler)
+    return app
+
+
+def export(summary, path, metadata):
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as handle:
+            writer = csv.writer(handle)
+            columns = ['requests', 'errors', 'error_rate', 'throughput_rps', 'mean_ms',
+                       'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+            writer.writerow(['method'] + columns)
+            for key, stats in summary.items():
+                writer.writerow([key] + [stats[column] for column in columns])
+    else:
+        with open(path, 'w') as handle:
+            json.dump({'metadata': metadata, 'summary': summary}, handle, indent=2)
+
+
+def format_ms(value):
+    """Format a latency column, n/a when the group had no samples."""
+    return f"{value:>9.1f}" if value is not None else f"{'n/a':>9}"
+
+
+def format_summary(summary, deltas=None):
+    header = f"{'method':<48}{'reqs':>8}{'err%':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    lines = [header, '-' * len(header)]
+    for key, stats in summary.items():
+        line = (f"{key:<48}{stats['requests']:>8}{100 * stats['error_rate']:>7.1f}{stats['throughput_rps']:>9.1f}"
+                f"{format_ms(stats['p50_ms'])}{format_ms(stats['p95_ms'])}{format_ms(stats['p99_ms'])}")
+        if deltas and key in deltas and deltas[key].get('p99_ms') is not None:
+            line += f"  p99 {100 * deltas[key]['p99_ms']:+.0f}%"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+async def main_async(args):
+    base = args.base_url
+    runner = None
+    if args.stub:
+        runner = web.AppRunner(stub_app(args.stub_latency_ms, args.stub_jitter_ms, args.stub_error_rate),
+                               access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', args.stub_port).start()
+        base = f"http://127.0.0.1:{args.stub_port}/v1.0/invoke"
+        logger.info(f"Stand-in server listening on port {args.stub_port}")
+    try:
+        logger.info(f"Driving {args.rps} requests/s for {args.duration}s against {base}")
+        samples, elapsed = await run_load(base, args.rps, args.duration, args.concurrency, args.timeout, args.seed)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+    return samples, elapsed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the Dapr services with the pipeline call mix.')
+    parser.add_argument('--base-url', default=base_url, help='Dapr invoke URL (default: %(default)s)')
+    parser.add_argument('--rps', type=float, default=20, help='Target requests per second')
+    parser.add_argument('--duration', type=float, default=30, help='Test duration in seconds')
+    parser.add_argument('--concurrency', type=int, default=100, help='Maximum requests in flight')
+    parser.add_argument('--timeout', type=float, default=5, help='Per-request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the call mix and payloads')
+    parser.add_argument('--output', help='Export results to a .json or .csv file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    parser.add_argument('--stub', action='store_true', help='Run against a local stand-in server')
+    parser.add_argument('--stub-port', type=int, default=3600)
+    parser.add_argument('--stub-latency-ms', type=float, default=5.0)
+    parser.add_argument('--stub-jitter-ms', type=float, default=5.0)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started_at = datetime.now()
+    samples, elapsed = asyncio.run(main_async(args))
+    summary = summarise(samples, elapsed)
+
+    deltas = None
+    if args.compare:
+        with open(args.compare) as handle:
+            deltas = compare(summary, json.load(handle)['summary'])
+    print(format_summary(summary, deltas))
+
+    if args.output:
+        metadata = {
+            'started_at': started_at.isoformat(),
+            'base_url': args.base_url if not args.stub else 'stub',
+            'target_rps': args.rps,
+            'duration': elapsed,
+            'concurrency': args.concurrency,
+        }
+        export(summary, args.output, metadata)
+        logger.info(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Circuit breakers, latency-budgeted retries and hedged requests for Dapr service calls.
+
+Breakers are kept per service for the whole process, so their state survives
+Streamlit reruns, like the telemetry in telemetry.py.
+"""
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Stop calling a service after repeated failures and probe it again later.
+
+    closed: calls go through; `failure_threshold` consecutive failures open the circuit.
+    open: calls are rejected until `reset_timeout` seconds have passed.
+    half-open: up to `half_open_max_calls` probe calls go through. A success
+    closes the circuit, a failure opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30.0, half_open_max_calls=1, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def allow_request(self):
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probes = 0
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            if state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self.clock()
+                self._probes = 0
+
+    def retry_after(self):
+        """Seconds until an open circuit lets a probe through."""
+        with self._lock:
+            if self._current_state() != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self.clock() - self._opened_at))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(service, **kwargs):
+    """Return the process-wide circuit breaker of a service."""
+    with _breakers_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(service, **kwargs)
+        return _breakers[service]
+
+
+def call_with_budget(fn, budget, attempt_timeout, max_attempts=3, backoff=0.1,
+                     retryable=lambda e: True, clock=time.monotonic, sleep=time.sleep):
+    """Call fn(timeout), retrying failures while the latency budget lasts.
+
+    Each attempt gets at most `attempt_timeout` seconds and never more than
+    what is left of `budget`, so the total time spent is bounded by `budget`.
+    """
+    deadline = clock() + budget
+    for attempt in range(max_attempts):
+        remaining = deadline - clock()
+        if remaining <= 0:
+            break
+        try:
+            return fn(min(attempt_timeout, remaining))
+        except Exception as e:
+            if not retryable(e) or attempt == max_attempts - 1:
+                raise
+            pause = min(backoff * (2 ** attempt) * random.uniform(0.5, 1.0), deadline - clock())
+            if pause <= 0:
+                raise
+            sleep(pause)
+    raise TimeoutError(f"Latency budget of {budget}s exhausted")
+
+
+class HedgePool:
+    """Threads for hedged requests that never queue work.
+
+    try_submit() returns None instead of queueing when every thread is busy,
+    so a submitted request starts right away and a hedge delay measures the
+    time the request has actually been running.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def try_submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+_hedge_pools = {}
+_hedge_pools_lock = threading.Lock()
+
+
+def get_hedge_pool(max_workers):
+    """Return the process-wide hedge pool with max_workers threads."""
+    with _hedge_pools_lock:
+        if max_workers not in _hedge_pools:
+            _hedge_pools[max_workers] = HedgePool(max_workers)
+        return _hedge_pools[max_workers]
+
+
+def hedged(fn, delay, pool=None, clock=time.monotonic):
+    """Wrap fn(timeout) so that a second, identical request is sent if the first
+    has not completed after `delay` seconds. The first successful response wins.
+
+    With delay None, fn is returned as-is. When the pool has no free thread,
+    the request runs on the calling thread without a hedge. Neither request
+    waits past `timeout`.
+
+    Only use this for idempotent requests. The slower request is not cancelled,
+    it finishes in the background.
+    """
+    if delay is None:
+        return fn
+    pool = pool or get_hedge_pool(8)
+
+    def call(timeout):
+        deadline = clock() + timeout
+        # Each request runs in a copy of the caller's context to keep the current trace span
+        first = pool.try_submit(copy_context().run, fn, timeout)
+        if first is None:
+            return fn(timeout)
+        futures = {first}
+        done, _ = wait(futures, timeout=min(delay, timeout))
+        if not done and deadline - clock() > 0:
+            second = pool.try_submit(copy_context().run, fn, deadline - clock())
+            if second is not None:
+                futures.add(second)
+        error = None
+        while futures:
+            done, futures = wait(futures, timeout=max(deadline - clock(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"No response within {timeout:.1f}s")
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+        raise error
+    return call
@@ -0,0 +1,128 @@
+"""Process-wide tracing and metrics setup for the Streamlit app.
+
+Streamlit re-executes app.py on every widget interaction, but imported modules
+stay loaded, so the state held here is created once per process. The
+collector connection is made by a background thread so that neither the first
+run nor any rerun waits for the OpenTelemetry Collector.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+from opentelemetry import trace
+from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import \
+    OTLPSpanExporter
+from opentelemetry.instrumentation.requests import RequestsInstrumentor
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (BatchSpanProcessor,
+                                            ConsoleSpanExporter)
+from opentelemetry.semconv.resource import ResourceAttributes
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               start_http_server)
+
+logger = logging.getLogger(__name__)
+
+OTLP_ENDPOINT = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT', 'http://127.0.0.1:4317')
+METRICS_PORT = 9092
+
+# Service invocation latency buckets, in seconds. The top buckets cover the 5s request timeout.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Telemetry:
+    def __init__(self, otlp_endpoint=OTLP_ENDPOINT, metrics_port=METRICS_PORT):
+        self.otlp_endpoint = otlp_endpoint
+        resource = Resource(attributes={
+            ResourceAttributes.SERVICE_NAME: "pythonapp"
+        })
+        self.tracer_provider = TracerProvider(resource=resource)
+        trace.set_tracer_provider(self.tracer_provider)
+        self.tracer = trace.get_tracer("pythonapp")
+
+        # Instrument the requests library
+        RequestsInstrumentor().instrument()
+
+        # Set up Prometheus metrics
+        self.registry = CollectorRegistry()
+        self.request_count = Counter('request_count', 'Total number of requests', registry=self.registry)
+        self.request_latency = Histogram(
+            'dapr_request_duration_seconds', 'Latency of Dapr service invocations',
+            ['service', 'method', 'status'], buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.requests_in_flight = Gauge(
+            'dapr_requests_in_flight', 'Dapr service invocations in progress',
+            ['service', 'method'], registry=self.registry)
+        self.request_errors = Counter(
+            'dapr_request_errors', 'Failed Dapr service invocations',
+            ['service', 'method', 'status'], registry=self.registry)
+        self.start_metrics_server(metrics_port)
+
+        self.exporter_ready = threading.Event()
+        threading.Thread(target=self.connect_exporter, name='otlp-connect', daemon=True).start()
+
+    def start_metrics_server(self, port):
+        try:
+            start_http_server(port=port, addr='0.0.0.0', registry=self.registry)
+            logger.info(f"Started Prometheus HTTP server on port {port}")
+        except OSError as e:
+            if e.errno == 98:  # Address already in use
+                logger.info(f"Prometheus HTTP server already running on port {port}")
+            else:
+                logger.error(f"Failed to start Prometheus HTTP server: {e}")
+
+    def observe_request(self, service, method, status, duration):
+        """Record the latency of one call, with the current trace id as exemplar.
+
+        Exemplars are only exposed in the OpenMetrics format, which Prometheus
+        requests when started with --enable-feature=exemplar-storage.
+        """
+        exemplar = None
+        span_context = trace.get_current_span().get_span_context()
+        if span_context.is_valid:
+            exemplar = {'trace_id': format(span_context.trace_id, '032x')}
+        self.request_latency.labels(service, method, status).observe(duration, exemplar=exemplar)
+
+    def collector_reachable(self, timeout=2):
+        endpoint = urlparse(self.otlp_endpoint)
+        try:
+            with socket.create_connection((endpoint.hostname, endpoint.port or 4317), timeout=timeout):
+                return True
+        except OSError:
+            return False
+
+    def connect_exporter(self, max_retries=5, retry_delay=5):
+        """Attach the OTLP exporter once the collector accepts connections.
+
+        Spans ended before this completes are not exported.
+        """
+        for attempt in range(max_retries):
+            if self.collector_reachable():
+                otlp_exporter = OTLPSpanExporter(endpoint=self.otlp_endpoint, insecure=True)
+                self.tracer_provider.add_span_processor(BatchSpanProcessor(otlp_exporter))
+                logger.info("Successfully connected to OpenTelemetry Collector")
+                break
+            if attempt < max_retries - 1:
+                logger.warning(f"Failed to connect to OpenTelemetry Collector. Retrying in {retry_delay} seconds...")
+                time.sleep(retry_delay)
+        else:
+            logger.error("Failed to connect to OpenTelemetry Collector after multiple attempts")
+            # Fallback to Console exporter if OTLP exporter fails
+            self.tracer_provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+            logger.info("Falling back to Console exporter")
+        self.exporter_ready.set()
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    """Return the process-wide Telemetry, creating it on first use."""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry()
+    return _telemetry
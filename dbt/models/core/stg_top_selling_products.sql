@@ -1,3 +1,5 @@
+{{ config(meta={'cache_snapshots': true}) }}
+
 SELECT
     t2.product_id
     , t2.product_name
@@ -1,3 +1,5 @@
+{{ config(meta={'cache_snapshots': true}) }}
+
 SELECT
     t2.aisle
     , sum(t1.number_of_orders) as number_of_orders
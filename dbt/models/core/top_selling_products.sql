@@ -1,3 +1,5 @@
+{{ config(meta={'cache_snapshots': true}) }}
+
 SELECT
     t1.product_name
     , t1.number_of_orders
@@ -1,3 +1,19 @@
+-- depends_on: {{ source('instacart_shards', 'daily_orders__partials') }}
+{% if var('sharded', false) | string | lower == 'true' %}
+-- Sum the partial counts of the hash shards (see airflow/plugins/dbt_sharding.py)
+SELECT
+    dt,
+    sum(daily_orders_count)::bigint as daily_orders_count
+FROM
+    {{ source('instacart_shards', 'daily_orders__partials') }}
+WHERE 
+    ds = '{{ var("end_date") }}'
+    AND dt >= '{{ var("start_date") }}' AND dt < '{{ var("end_date") }}'
+group by
+    dt
+order by
+    dt asc
+{% else %}
 SELECT
     date(order_date) as dt,
     count(order_id) as daily_orders_count
@@ -8,4 +24,5 @@ WHERE
 group by
     dt
 order by
-    dt asc
\ No newline at end of file
+    dt asc
+{% endif %}
@@ -0,0 +1,137 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'dapr', 'python'))
+
+from analytics import Analytics
+
+Column = namedtuple('Column', 'name')
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        # The fingerprint query is a plain string, model queries are composed with psycopg2.sql
+        kind = 'fingerprint' if isinstance(query, str) else 'model'
+        self.conn.database.queries.append((kind, params))
+        if kind == 'fingerprint':
+            self.rows = [self.conn.database.fingerprint]
+        else:
+            self.description = [Column(name) for name in self.conn.database.columns]
+            self.rows = list(self.conn.database.rows)
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+
+    def __init__(self, database):
+        self.database = database
+        self.closed = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.database.rollbacks += 1
+
+
+class FakePool:
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+        self.fingerprint = (16384, 10, 0, 0)
+        self.queries = []
+        self.rollbacks = 0
+        self.borrowed = 0
+
+    def getconn(self):
+        self.borrowed += 1
+        return FakeConnection(self)
+
+    def putconn(self, conn, close=False):
+        self.borrowed -= 1
+
+
+class TestAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.pool = FakePool(['aisle', 'number_of_orders'], [('fresh fruits', 300), ('yogurt', 100), ('soy', 50)])
+        self.analytics = Analytics(pool=self.pool, state_dir=self.state_dir)
+
+    def write_state(self, model, built_at):
+        with open(os.path.join(self.state_dir, f'{model}.json'), 'w') as handle:
+            json.dump({'model': model, 'built_at': built_at}, handle)
+
+    def model_queries(self):
+        return [query for query in self.pool.queries if query[0] == 'model']
+
+    def test_reads_through_the_pool(self):
+        df, cache_hit = self.analytics.top_selling('aisles')
+        self.assertFalse(cache_hit)
+        self.assertEqual(df['aisle'].tolist(), ['fresh fruits', 'yogurt', 'soy'])
+        self.assertEqual(self.pool.borrowed, 0)
+        self.assertGreater(self.pool.rollbacks, 0)
+        self.assertEqual(self.model_queries()[0][1], (10,))
+
+    def test_empty_result_keeps_columns(self):
+        self.pool.rows = []
+        df, _ = self.analytics.top_selling('aisles')
+        self.assertEqual(list(df.columns), ['aisle', 'number_of_orders'])
+        self.assertTrue(df.empty)
+
+    def test_cached_until_rebuilt(self):
+        self.write_state('top_selling_aisles', '2024-01-01T00:00:00')
+        self.analytics.top_selling('aisles')
+        _, cache_hit = self.analytics.top_selling('aisles')
+        self.assertTrue(cache_hit)
+        self.assertEqual(len(self.model_queries()), 1)
+        # The run state is enough to tell the version, no fingerprint query
+        self.assertEqual(len(self.pool.queries), 1)
+
+        self.write_state('top_selling_aisles', '2024-01-02T00:00:00')
+        _, cache_hit = self.analytics.top_selling('aisles')
+        self.assertFalse(cache_hit)
+        self.assertEqual(len(self.model_queries()), 2)
+
+    def test_fingerprint_fallback(self):
+        self.analytics.top_selling('aisles')
+        _, cache_hit = self.analytics.top_selling('aisles')
+        self.assertTrue(cache_hit)
+        self.assertEqual([query for query in self.pool.queries if query[0] == 'fingerprint'][0][1], ('dbt', 'top_selling_aisles'))
+
+        self.pool.fingerprint = (16999, 10, 0, 0)
+        _, cache_hit = self.analytics.top_selling('aisles')
+        self.assertFalse(cache_hit)
+
+    def test_daily_range_is_part_of_the_key(self):
+        self.write_state('daily_orders_7_day_avg', '2024-01-01T00:00:00')
+        self.analytics.daily_orders_7_day_avg('2019-01-01', '2019-02-01')
+        _, cache_hit = self.analytics.daily_orders_7_day_avg('2019-02-01', '2019-03-01')
+        self.assertFalse(cache_hit)
+        self.assertEqual(self.model_queries()[-1][1], ('2019-02-01', '2019-03-01'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow', 'plugins'))
+
+from audit_event_sensor import AuditEventTrigger, find_event, parse_entry, search_stream
+
+
+def entry(entry_id, event, envelope=True):
+    payload = {'specversion': '1.0', 'type': 'com.dapr.event.sent', 'data': event} if envelope else event
+    return entry_id, {b'data': json.dumps(payload).encode()}
+
+
+def stream_id(value):
+    return tuple(int(part) for part in value.split('-'))
+
+
+def revrange(history, upper, count):
+    """XREVRANGE over history with an inclusive or (exclusive upper bound."""
+    entries = list(reversed(history))
+    if upper != '+':
+        exclusive = upper.startswith('(')
+        bound = stream_id(upper.lstrip('('))
+        entries = [e for e in entries if stream_id(e[0]) < bound or (not exclusive and stream_id(e[0]) == bound)]
+    return entries[:count]
+
+
+class SyncStream:
+
+    def __init__(self, history):
+        self.history = list(history)
+        self.pages = 0
+
+    def xrevrange(self, stream, max='+', count=None):
+        self.pages += 1
+        return revrange(self.history, max, count)
+
+
+class FakeStream:
+    """Stands in for redis.asyncio: serves XREVRANGE from `history` and XREAD from `incoming`."""
+
+    def __init__(self, history, incoming=()):
+        self.history = list(history)
+        self.incoming = list(incoming)
+        self.read_from = []
+        self.closed = False
+
+    async def xrevrange(self, stream, max='+', count=None):
+        return revrange(self.history, max, count)
+
+    async def xread(self, streams, count=None, block=None):
+        self.read_from.append(list(streams.values())[0])
+        if not self.incoming:
+            raise ConnectionError('stream closed')
+        return [(b'audit-events', [self.incoming.pop(0)])]
+
+    async def aclose(self):
+        self.closed = True
+
+
+def first_event(trigger, client):
+    trigger.get_client = lambda: client
+
+    async def run():
+        async for event in trigger.run():
+            return event.payload
+    return asyncio.run(run())
+
+
+class TestAuditEventSensor(unittest.TestCase):
+
+    def test_parse_entry(self):
+        event = {'status': 'end', 'correlationId': 'corr-1'}
+        self.assertEqual(parse_entry(entry('1-0', event)[1]), event)
+        self.assertEqual(parse_entry(entry('1-0', event, envelope=False)[1]), event)
+        self.assertIsNone(parse_entry({b'data': b'not json'}))
+        self.assertIsNone(parse_entry({}))
+
+    def test_find_event(self):
+        entries = [entry('1-0', {'status': 'start', 'correlationId': 'corr-1'}),
+                   entry('2-0', {'status': 'end', 'correlationId': 'corr-2'}),
+                   entry('3-0', {'status': 'end', 'correlationId': 'corr-1', 'result': 'success'})]
+        self.assertEqual(find_event(entries, 'corr-1')['result'], 'success')
+        self.assertEqual(find_event(entries, 'corr-1', status='start')['status'], 'start')
+        self.assertIsNone(find_event(entries, 'corr-3'))
+
+    def test_trigger_finds_past_event(self):
+        client = FakeStream([entry('1-0', {'status': 'end', 'correlationId': 'corr-1'})])
+        payload = first_event(AuditEventTrigger('corr-1'), client)
+        self.assertEqual(payload['status'], 'success')
+        self.assertEqual(payload['event']['correlationId'], 'corr-1')
+        self.assertEqual(client.read_from, [])
+        self.assertTrue(client.closed)
+
+    def test_trigger_waits_for_new_event(self):
+        client = FakeStream([entry('1-0', {'status': 'start', 'correlationId': 'corr-1'})],
+                            [entry('2-0', {'status': 'end', 'correlationId': 'corr-2'}),
+                             entry('3-0', {'status': 'end', 'correlationId': 'corr-1'})])
+        payload = first_event(AuditEventTrigger('corr-1'), client)
+        self.assertEqual(payload['event']['correlationId'], 'corr-1')
+        self.assertEqual(client.read_from, ['1-0', '2-0'])
+
+    def test_trigger_reads_empty_stream_from_start(self):
+        client = FakeStream([])
+        payload = first_event(AuditEventTrigger('corr-1'), client)
+        self.assertEqual(payload['status'], 'error')
+        self.assertEqual(client.read_from, ['0-0'])
+
+    def test_trigger_finds_events_beyond_the_first_page(self):
+        history = [entry('1-0', {'status': 'end', 'correlationId': 'corr-1'})]
+        history += [entry(f'{i}-0', {'status': 'start', 'correlationId': f'corr-{i}'}) for i in range(2, 8)]
+        payload = first_event(AuditEventTrigger('corr-1', page_size=2), FakeStream(history))
+        self.assertEqual(payload['status'], 'success')
+
+        client = FakeStream(history, [entry('8-0', {'status': 'end', 'correlationId': 'corr-9'})])
+        first_event(AuditEventTrigger('corr-9', page_size=2), client)
+        # After searching every page, XREAD continues from the newest entry
+        self.assertEqual(client.read_from[0], '7-0')
+
+    def test_search_stream_pages(self):
+        history = [entry(f'{i}-0', {'status': 'end', 'correlationId': f'corr-{i}'}) for i in range(1, 6)]
+        client = SyncStream(history)
+        event, newest = search_stream(client, 'audit-events', 'corr-1', page_size=2)
+        self.assertEqual(event['correlationId'], 'corr-1')
+        self.assertEqual(newest, '5-0')
+        self.assertEqual(client.pages, 3)
+        self.assertEqual(search_stream(SyncStream([]), 'audit-events', 'corr-1'), (None, None))
+
+    def test_trigger_serializes(self):
+        classpath, kwargs = AuditEventTrigger('corr-1', page_size=10).serialize()
+        self.assertEqual(classpath, 'audit_event_sensor.AuditEventTrigger')
+        self.assertEqual(AuditEventTrigger(**kwargs).serialize(), (classpath, kwargs))
+
+
+if __name__ == '__main__':
+    unittest.main()
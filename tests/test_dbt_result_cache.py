@@ -0,0 +1,205 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow', 'plugins'))
+
+import dbt_result_cache
+import dbt_state
+from dbt_operator import DbtRunOperator
+
+NODE = {
+    'resource_type': 'model', 'name': 'stg_top_selling_products', 'schema': 'dbt',
+    'alias': 'stg_top_selling_products', 'package_name': 'instacart_dbt_models',
+    'original_file_path': 'models/core/stg_top_selling_products.sql', 'raw_code': 'select 1',
+    'checksum': {'name': 'sha256', 'checksum': 'aaa'}, 'config': {'meta': {'cache_snapshots': True}},
+}
+MANIFEST = {
+    'nodes': {'model.instacart_dbt_models.stg_top_selling_products': NODE},
+    'sources': {'source.instacart_dbt_models.instacart_raw_data.products': {
+        'schema': 'dbt_raw_data', 'identifier': 'products'}},
+    'parent_map': {'model.instacart_dbt_models.stg_top_selling_products': [
+        'source.instacart_dbt_models.instacart_raw_data.products']},
+}
+
+
+class FakeCursor:
+    """Answers the catalog, load state and snapshot registry queries of DbtRunOperator."""
+
+    def __init__(self, database):
+        self.database = database
+        self.query = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.query = query if isinstance(query, str) else repr(query)
+        self.database.queries.append(self.query)
+
+    def fetchone(self):
+        if 'count(*)' in self.query:
+            return self.database.fingerprint
+        if 'table_name, duration' in self.query:
+            return None
+        return (True,)
+
+    def fetchall(self):
+        if 'table_name, sha256' in self.query:
+            return list(self.database.loaded.items())
+        return []
+
+
+class CatalogCursor:
+    """Answers the column lookups of restore_snapshot and records the other statements."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.params = None
+        self.statements = []
+
+    def execute(self, query, params=None):
+        self.params = params
+        if 'pg_attribute' not in query:
+            self.statements.append(repr(query))
+
+    def fetchall(self):
+        return self.columns.get(self.params, [])
+
+
+class FakeConnection:
+
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self):
+        return FakeCursor(self.database)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestDbtResultCache(unittest.TestCase):
+
+    def test_cache_key_is_content_addressed(self):
+        sources = {'dbt_raw_data.products': [49688, 731]}
+        parents = {'order_products': 'build-1'}
+        key = dbt_result_cache.cache_key('select 1', sources, parents)
+        self.assertEqual(key, dbt_result_cache.cache_key('select 1', dict(sources), dict(parents)))
+        self.assertNotEqual(key, dbt_result_cache.cache_key('select 2', sources, parents))
+        self.assertNotEqual(key, dbt_result_cache.cache_key('select 1', {'dbt_raw_data.products': [49689, 731]}, parents))
+        self.assertNotEqual(key, dbt_result_cache.cache_key('select 1', sources, {'order_products': 'build-2'}))
+
+    def test_model_sql_ignores_compiled_files(self):
+        node = {'raw_code': "select * from {{ ref('x') }}", 'compiled_code': 'select * from dbt.x'}
+        self.assertEqual(dbt_result_cache.model_sql(node), node['raw_code'])
+        self.assertEqual(dbt_result_cache.model_sql({'raw_sql': 'select 1'}), 'select 1')
+
+    def test_snapshot_table_name(self):
+        self.assertEqual(dbt_result_cache.snapshot_table('top_selling_products', 'abcdef0123456789ffff'),
+                         'top_selling_products__abcdef0123456789')
+
+    def test_restore_refills_the_existing_table(self):
+        columns = [('product_id', 'integer'), ('count', 'bigint')]
+        cursor = CatalogCursor({('dbt', 'top'): columns, ('dbt_cache', 'top__abc'): columns})
+        self.assertTrue(dbt_result_cache.restore_snapshot(cursor, 'top__abc', 'dbt', 'top'))
+        self.assertEqual(len(cursor.statements), 2)
+        self.assertIn('truncate', cursor.statements[0])
+        self.assertIn('insert into', cursor.statements[1])
+        self.assertFalse(any('drop' in statement for statement in cursor.statements))
+
+    def test_restore_with_other_columns_changes_nothing(self):
+        cursor = CatalogCursor({('dbt', 'top'): [('product_id', 'integer')],
+                                ('dbt_cache', 'top__abc'): [('product_id', 'integer'), ('count', 'bigint')]})
+        self.assertFalse(dbt_result_cache.restore_snapshot(cursor, 'top__abc', 'dbt', 'top'))
+        self.assertEqual(cursor.statements, [])
+
+    def test_restore_creates_a_missing_table(self):
+        cursor = CatalogCursor({('dbt_cache', 'top__abc'): [('product_id', 'integer')]})
+        self.assertTrue(dbt_result_cache.restore_snapshot(cursor, 'top__abc', 'dbt', 'top'))
+        self.assertEqual(len(cursor.statements), 1)
+        self.assertIn('create table', cursor.statements[0])
+
+    def test_cache_key_covers_file_checksum_and_vars(self):
+        key = dbt_result_cache.cache_key('select 1', {}, {}, checksum='aaa', dbt_vars={'x': 1})
+        self.assertNotEqual(key, dbt_result_cache.cache_key('select 1', {}, {}, checksum='bbb', dbt_vars={'x': 1}))
+        self.assertNotEqual(key, dbt_result_cache.cache_key('select 1', {}, {}, checksum='aaa', dbt_vars={'x': 2}))
+
+    def test_content_addressed(self):
+        self.assertTrue(dbt_result_cache.content_addressed({'dbt_raw_data.products': {'sha256': 'abc'}}))
+        self.assertFalse(dbt_result_cache.content_addressed({'dbt_raw_data.products': {'sha256': 'abc'},
+                                                             'dbt.daily_orders__partials': [3, 731]}))
+
+
+class TestDbtRunOperatorResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        manifest_path = os.path.join(self.state_dir, 'manifest.json')
+        with open(manifest_path, 'w') as handle:
+            json.dump(MANIFEST, handle)
+        self.database = mock.Mock(loaded={'products': 'abc'}, queries=[], fingerprint=(49688, 731))
+        self.operator = DbtRunOperator(task_id='stg_top_selling_products', model='stg_top_selling_products',
+                                       skip_unchanged=True, result_cache=True, cache_snapshots=True,
+                                       manifest_path=manifest_path, state_dir=self.state_dir,
+                                       project_dir=os.path.join(self.state_dir, 'missing'))
+        self.operator.get_conn = lambda: FakeConnection(self.database)
+        self.operator.run_dbt = mock.Mock(return_value=None)
+
+    def execute(self):
+        return self.operator.execute({'ti': mock.Mock(), 'dag_run': None})
+
+    def snapshots_saved(self):
+        return sum("SQL(' as table ')" in query for query in self.database.queries)
+
+    def test_identical_reload_hits(self):
+        self.execute()
+        state = dbt_state.read_state('stg_top_selling_products', self.state_dir)
+        self.assertTrue(state['reproducible'])
+        self.assertEqual(state['build_id'], state['cache_key'])
+        self.assertEqual(self.snapshots_saved(), 1)
+
+        # The same file loaded again: the rows have a newer xmin, the content is the same
+        self.database.fingerprint = (49688, 812)
+        self.assertTrue(self.execute()['cache_hit'])
+        self.assertEqual(self.operator.run_dbt.call_count, 1)
+
+        self.database.loaded = {'products': 'def'}
+        self.assertIsNone(self.execute())
+        self.assertEqual(self.operator.run_dbt.call_count, 2)
+
+    def test_sql_edit_changes_the_key_once(self):
+        self.operator.project_dir = tempfile.mkdtemp()
+        path = os.path.join(self.operator.project_dir, NODE['original_file_path'])
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as handle:
+            handle.write('select 1\n')
+        self.execute()
+        with open(path, 'w') as handle:
+            handle.write('select 2\n')
+        # manifest.json still holds the old SQL until the next parse, the key follows the file
+        self.assertIsNone(self.execute())
+        self.assertTrue(self.execute()['cache_hit'])
+        self.assertEqual(self.operator.run_dbt.call_count, 2)
+
+    def test_no_snapshot_for_keys_that_cannot_repeat(self):
+        # Not loaded by 1_load_initial_data: only the row count and xmin identify the content
+        self.database.loaded = {}
+        self.execute()
+        state = dbt_state.read_state('stg_top_selling_products', self.state_dir)
+        self.assertFalse(state['reproducible'])
+        self.assertNotEqual(state['build_id'], state['cache_key'])
+        self.assertEqual(self.snapshots_saved(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from multiprocessing.connection import Listener
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow', 'plugins'))
+
+import dbt_runner_pool
+from airflow.exceptions import AirflowException
+from dbt_operator import DbtRunOperator
+
+AUTHKEY = b'test'
+
+
+def fake_init(project_dir):
+    pass
+
+
+def fake_invoke(args):
+    """Stands in for a dbt invocation: `sleep N`, `die`, or echo the arguments."""
+    if args[0] == 'sleep':
+        time.sleep(float(args[1]))
+    if args[0] == 'die':
+        os._exit(3)
+    return {'success': True, 'error': None, 'results': [{'pid': os.getpid(), 'args': args}], 'log': []}
+
+
+class TestDbtRunnerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.address = os.path.join(tempfile.mkdtemp(), 'pool.sock')
+        self.pool = dbt_runner_pool.WorkerPool(1, init=fake_init, invoke=fake_invoke, max_invocations=3)
+        self.listener = Listener(self.address, authkey=AUTHKEY)
+        threading.Thread(target=dbt_runner_pool.serve_connections, args=(self.listener, self.pool),
+                         daemon=True).start()
+
+    def tearDown(self):
+        self.listener.close()
+        self.pool.close()
+
+    def run_args(self, *args, timeout=10):
+        return dbt_runner_pool.run_in_pool(list(args), address=self.address, authkey=AUTHKEY, timeout=timeout)
+
+    def test_runs_in_a_warm_worker(self):
+        first = self.run_args('run', '--models', 'a')
+        second = self.run_args('run', '--models', 'b')
+        self.assertTrue(first['success'])
+        self.assertEqual(first['results'][0]['args'], ['run', '--models', 'a'])
+        self.assertEqual(first['results'][0]['pid'], second['results'][0]['pid'])
+
+    def test_worker_is_recycled(self):
+        pids = {self.run_args('run')['results'][0]['pid'] for _ in range(4)}
+        self.assertEqual(len(pids), 2)
+
+    def test_dead_worker_fails_the_run_and_is_replaced(self):
+        response = self.run_args('die')
+        self.assertFalse(response['success'])
+        self.assertIn('exited with code 3', response['error'])
+        self.assertTrue(self.run_args('run')['success'])
+
+    def test_timeout_cancels_the_run(self):
+        with self.assertRaises(dbt_runner_pool.DbtRunnerPoolTimeout):
+            self.run_args('sleep', '30', timeout=0.2)
+        # The only worker was killed and replaced instead of sleeping on
+        started = time.monotonic()
+        self.assertTrue(self.run_args('run')['success'])
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_cancel(self):
+        connection = dbt_runner_pool.connect(self.address, AUTHKEY)
+        threading.Timer(0.2, dbt_runner_pool.cancel, args=(connection,)).start()
+        with self.assertRaises(dbt_runner_pool.DbtRunnerPoolUnavailable):
+            dbt_runner_pool.run_in_pool(['sleep', '30'], address=self.address, timeout=10, connection=connection)
+        self.assertTrue(self.run_args('run')['success'])
+
+    def test_unreachable(self):
+        with self.assertRaises(dbt_runner_pool.DbtRunnerPoolUnavailable):
+            dbt_runner_pool.run_in_pool(['run'], address=self.address + '.missing', authkey=AUTHKEY)
+
+
+class FakeManifest:
+
+    def write(self, path):
+        with open(path, 'w') as handle:
+            handle.write('{"nodes": {}}')
+
+
+class TestWriteManifest(unittest.TestCase):
+
+    def test_replaces_the_manifest_atomically(self):
+        target = tempfile.mkdtemp()
+        path = os.path.join(target, 'manifest.json')
+        with open(path, 'w') as handle:
+            handle.write('{"old": true}')
+        dbt_runner_pool.write_manifest(FakeManifest(), path)
+        with open(path) as handle:
+            self.assertEqual(handle.read(), '{"nodes": {}}')
+        self.assertEqual(os.listdir(target), ['manifest.json'])
+
+
+class TestDbtRunOperatorPool(unittest.TestCase):
+
+    def setUp(self):
+        self.address = os.path.join(tempfile.mkdtemp(), 'pool.sock')
+        self.operator = DbtRunOperator(task_id='run_model', model='model', pool_address=self.address,
+                                       pool_timeout=0.2)
+        self.operator.run_subprocess = mock.Mock(return_value='cli')
+
+    def serve_once(self, handle):
+        """A stand-in server that receives one request and hands it to handle(connection)."""
+        listener = Listener(self.address, authkey=dbt_runner_pool.DEFAULT_AUTHKEY)
+
+        def accept():
+            with listener, listener.accept() as connection:
+                connection.recv()
+                handle(connection)
+        thread = threading.Thread(target=accept, daemon=True)
+        thread.start()
+        return thread
+
+    def test_falls_back_when_pool_is_not_running(self):
+        self.assertEqual(self.operator.run_dbt(['run']), 'cli')
+
+    def test_falls_back_when_pool_dies_mid_run(self):
+        self.serve_once(lambda connection: None)
+        self.assertEqual(self.operator.run_dbt(['run']), 'cli')
+        self.operator.run_subprocess.assert_called_once_with(['run'])
+
+    def test_uses_the_pool(self):
+        self.serve_once(lambda connection: connection.send({'success': True, 'error': None, 'results': ['ok'],
+                                                            'log': ['done']}))
+        self.assertEqual(self.operator.run_dbt(['run']), ['ok'])
+        self.operator.run_subprocess.assert_not_called()
+
+    def test_timeout_fails_without_fallback(self):
+        thread = self.serve_once(lambda connection: connection.poll(5))
+        with self.assertRaises(AirflowException):
+            self.operator.run_dbt(['run'])
+        self.operator.run_subprocess.assert_not_called()
+        thread.join(5)
+
+    def test_on_kill_cancels_the_pool_run(self):
+        self.operator.pool_connection = mock.Mock()
+        self.operator.on_kill()
+        self.operator.pool_connection.send.assert_called_once_with({'cancel': True})
+
+
+if __name__ == '__main__':
+    unittest.main()
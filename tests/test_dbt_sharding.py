@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow', 'plugins'))
+
+import dbt_sharding
+
+
+class RecordingCursor:
+
+    def __init__(self):
+        self.statements = []
+        self.rowcount = 3
+
+    def execute(self, query, params=None):
+        self.statements.append((repr(query), params))
+
+
+class TestDbtSharding(unittest.TestCase):
+
+    def test_shard_count(self):
+        with mock.patch.dict(os.environ, {dbt_sharding.SHARDS_ENV: '4'}):
+            self.assertEqual(dbt_sharding.shard_count(), 4)
+            self.assertEqual(dbt_sharding.shard_count({'daily_shards': 8}), 8)
+            self.assertEqual(dbt_sharding.shard_count({'other': 1}), 4)
+        with mock.patch.dict(os.environ, {dbt_sharding.SHARDS_ENV: ''}):
+            self.assertEqual(dbt_sharding.shard_count(), 0)
+            self.assertEqual(dbt_sharding.shard_count({'daily_shards': -2}), 0)
+
+    def test_shard_args(self):
+        self.assertEqual(dbt_sharding.shard_args(3), [[0, 3], [1, 3], [2, 3]])
+        self.assertEqual(dbt_sharding.shard_args(1), [])
+        self.assertEqual(dbt_sharding.shard_args(0), [])
+
+    def test_count_shard_replaces_its_rows(self):
+        cursor = RecordingCursor()
+        days = dbt_sharding.count_shard(cursor, '2019-01-02', '2019-01-01', '2019-01-02', shard=1, shards=4)
+        self.assertEqual(days, 3)
+        (delete, delete_params), (insert, insert_params) = cursor.statements
+        self.assertIn('delete from', delete)
+        self.assertEqual(delete_params, ('2019-01-02', 1))
+        self.assertIn("Identifier('daily_orders__partials')", insert)
+        self.assertIn("Identifier('clean_orders')", insert)
+        self.assertIn('mod(hashtext(user_id::text) & 2147483647, %(shards)s) = %(shard)s', insert)
+        self.assertEqual(insert_params, {'ds': '2019-01-02', 'shard': 1, 'shards': 4,
+                                         'start_date': '2019-01-01', 'end_date': '2019-01-02'})
+
+    def test_plan_without_shards_does_not_connect(self):
+        dag_run = mock.Mock(conf={'daily_shards': 1})
+        with mock.patch.object(dbt_sharding, 'PostgresHook') as hook:
+            self.assertEqual(dbt_sharding.plan_shards('2019-01-02', dag_run=dag_run), [])
+        hook.assert_not_called()
+
+    def test_plan_clears_the_day(self):
+        cursor = RecordingCursor()
+        dag_run = mock.Mock(conf={'daily_shards': 2})
+        with mock.patch.object(dbt_sharding, 'PostgresHook') as hook:
+            conn = hook.return_value.get_conn.return_value
+            conn.cursor.return_value.__enter__.return_value = cursor
+            self.assertEqual(dbt_sharding.plan_shards('2019-01-02', dag_run=dag_run), [[0, 2], [1, 2]])
+        self.assertIn('create table if not exists', cursor.statements[0][0])
+        self.assertEqual(cursor.statements[1][1], ('2019-01-02',))
+        conn.commit.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow', 'plugins'))
+
+import dbt_state
+
+MANIFEST = {
+    'nodes': {
+        'model.instacart_dbt_models.order_products': {
+            'resource_type': 'model', 'name': 'order_products', 'schema': 'dbt', 'alias': 'order_products',
+            'checksum': {'name': 'sha256', 'checksum': 'aaa'},
+        },
+        'model.instacart_dbt_models.stg_top_selling_products': {
+            'resource_type': 'model', 'name': 'stg_top_selling_products', 'schema': 'dbt',
+            'alias': 'stg_top_selling_products', 'checksum': {'name': 'sha256', 'checksum': 'bbb'},
+        },
+    },
+    'sources': {
+        'source.instacart_dbt_models.instacart_raw_data.products': {
+            'schema': 'dbt_raw_data', 'identifier': 'products',
+        },
+    },
+    'parent_map': {
+        'model.instacart_dbt_models.order_products': [],
+        'model.instacart_dbt_models.stg_top_selling_products': [
+            'model.instacart_dbt_models.order_products',
+            'source.instacart_dbt_models.instacart_raw_data.products',
+        ],
+    },
+}
+
+
+class FakeCursor:
+    """Answers the catalog and load state queries of relation_fingerprints."""
+
+    def __init__(self, tables, loaded):
+        self.tables = tables
+        self.loaded = loaded
+        self.query = None
+        self.params = None
+
+    def execute(self, query, params=None):
+        self.query = query if isinstance(query, str) else repr(query)
+        self.params = params
+
+    def fetchone(self):
+        if 'to_regclass' in self.query:
+            return (self.params[0] in self.tables,)
+        return next(rows for name, rows in self.tables.items() if repr(name.split('.')[1]) in self.query)
+
+    def fetchall(self):
+        return list(self.loaded.items())
+
+
+class TestDbtState(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.unique_id, self.node = dbt_state.model_node(MANIFEST, 'stg_top_selling_products')
+
+    def test_manifest_lookups(self):
+        self.assertEqual(self.unique_id, 'model.instacart_dbt_models.stg_top_selling_products')
+        self.assertEqual(dbt_state.parent_models(MANIFEST, self.unique_id), ['order_products'])
+        self.assertEqual(dbt_state.source_relations(MANIFEST, self.unique_id), [('dbt_raw_data', 'products')])
+        self.assertEqual(dbt_state.model_node(MANIFEST, 'missing'), (None, None))
+
+    def test_state_round_trip(self):
+        state = dbt_state.new_state('order_products', MANIFEST['nodes']['model.instacart_dbt_models.order_products'],
+                                    {}, {}, 1.5)
+        dbt_state.write_state('order_products', state, self.state_dir)
+        self.assertEqual(dbt_state.read_state('order_products', self.state_dir), state)
+        self.assertEqual(dbt_state.parent_builds(['order_products', 'other'], self.state_dir),
+                         {'order_products': state['build_id'], 'other': None})
+
+    def test_unchanged_model(self):
+        sources = {'dbt_raw_data.products': [49688, 731]}
+        parents = {'order_products': 'build-1'}
+        previous = dbt_state.new_state('stg_top_selling_products', self.node, sources, parents, 2.0)
+        self.assertEqual(dbt_state.change_reasons(self.node, previous, sources, parents), [])
+
+    def test_change_reasons(self):
+        sources = {'dbt_raw_data.products': [49688, 731]}
+        parents = {'order_products': 'build-1'}
+        previous = dbt_state.new_state('stg_top_selling_products', self.node, sources, parents, 2.0)
+
+        self.assertEqual(dbt_state.change_reasons(self.node, None, sources, parents),
+                         ['no previous successful build recorded'])
+        changed_node = dict(self.node, checksum={'name': 'sha256', 'checksum': 'ccc'})
+        self.assertEqual(dbt_state.change_reasons(changed_node, previous, sources, parents), ['model SQL changed'])
+        self.assertEqual(
+            dbt_state.change_reasons(self.node, previous, {'dbt_raw_data.products': [49688, 812]}, parents),
+            ['source dbt_raw_data.products changed'])
+        self.assertEqual(dbt_state.change_reasons(self.node, previous, sources, {'order_products': 'build-2'}),
+                         ['parent order_products was rebuilt'])
+        self.assertEqual(dbt_state.change_reasons(self.node, previous, {'dbt_raw_data.products': None}, parents),
+                         ['source dbt_raw_data.products does not exist'])
+
+    def test_file_checksum_tracks_edits_before_a_parse(self):
+        project_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(project_dir, 'models'))
+        path = os.path.join(project_dir, 'models', 'stg_top_selling_products.sql')
+        with open(path, 'w') as handle:
+            handle.write('select 1\n')
+        node = dict(self.node, original_file_path='models/stg_top_selling_products.sql')
+        previous = dbt_state.new_state('stg_top_selling_products', dbt_state.with_file_checksum(node, project_dir),
+                                       {}, {}, 1.0)
+        self.assertEqual(previous['checksum'], hashlib.sha256(b'select 1\n').hexdigest())
+        self.assertEqual(dbt_state.with_file_checksum(node, project_dir)['raw_code'], 'select 1\n')
+
+        with open(path, 'w') as handle:
+            handle.write('select 2\n')
+        # manifest.json still holds the old checksum, the file does not
+        self.assertEqual(dbt_state.change_reasons(dbt_state.with_file_checksum(node, project_dir), previous, {}, {}),
+                         ['model SQL changed'])
+        self.assertEqual(dbt_state.with_file_checksum(node, os.path.join(project_dir, 'missing')), node)
+
+    def test_relation_fingerprints(self):
+        tables = {'dbt_raw_data._load_state': None, 'dbt_raw_data.products': (49688, 731),
+                  'dbt_raw_data.aisles': (134, 702)}
+        relations = [('dbt_raw_data', 'products'), ('dbt_raw_data', 'aisles'), ('dbt_raw_data', 'departments')]
+        self.assertEqual(dbt_state.relation_fingerprints(FakeCursor(tables, {'products': 'abc'}), relations), {
+            'dbt_raw_data.products': {'sha256': 'abc'},
+            'dbt_raw_data.aisles': [134, 702],
+            'dbt_raw_data.departments': None,
+        })
+        # Without a load state every table is fingerprinted by its rows
+        del tables['dbt_raw_data._load_state']
+        self.assertEqual(dbt_state.relation_fingerprints(FakeCursor(tables, {}), relations[:1]),
+                         {'dbt_raw_data.products': [49688, 731]})
+
+    def test_load_manifest_retries_partial_reads(self):
+        path = os.path.join(self.state_dir, 'manifest.json')
+        with open(path, 'w') as handle:
+            handle.write('{"nodes": {')
+        with self.assertRaises(ValueError):
+            dbt_state.load_manifest(path, attempts=2, delay=0)
+        with open(path, 'w') as handle:
+            json.dump(MANIFEST, handle)
+        self.assertEqual(dbt_state.load_manifest(path), MANIFEST)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow', 'scripts'))
+
+import generate_instacart_data as gen
+
+
+class TestGenerateInstacartData(unittest.TestCase):
+
+    def test_chunk_ranges_cover_all_users(self):
+        ranges = list(gen.chunk_ranges(12, chunk_users=5))
+        self.assertEqual(ranges, [(0, 1, 6), (1, 6, 11), (2, 11, 13)])
+
+    def test_user_chunk_is_deterministic(self):
+        first = gen.generate_user_chunk(7, 1, 20)
+        second = gen.generate_user_chunk(7, 1, 20)
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, gen.generate_user_chunk(8, 1, 20))
+
+    def test_orders_shape(self):
+        tables = gen.generate_user_chunk(1, 1, 50)
+        orders = tables['orders']
+        order_ids = [row[0] for row in orders]
+        self.assertEqual(len(order_ids), len(set(order_ids)))
+        for order_id, user_id, eval_set, order_number, dow, hour, days_since_prior in orders:
+            self.assertIn(eval_set, ('prior', 'train', 'test'))
+            self.assertTrue(0 <= dow < 7 and 0 <= hour < 24)
+            self.assertEqual(days_since_prior == '', order_number == 1)
+
+        train_orders = {row[0] for row in orders if row[2] == 'train'}
+        self.assertEqual({row[0] for row in tables['order_products__train']}, train_orders)
+
+    def test_basket_has_no_duplicates(self):
+        rows = gen.generate_user_chunk(3, 1, 30)['order_products__prior']
+        keys = [(order_id, product_id) for order_id, product_id, _, _ in rows]
+        self.assertEqual(len(keys), len(set(keys)))
+
+    def test_dimensions_are_consistent(self):
+        dimensions = gen.generate_dimensions(5)
+        self.assertEqual(len(dimensions['products']), gen.NUM_PRODUCTS)
+        aisle_ids = {aisle_id for aisle_id, _ in dimensions['aisles']}
+        department_ids = {department_id for department_id, _ in dimensions['departments']}
+        for _, _, aisle_id, department_id in dimensions['products']:
+            self.assertIn(aisle_id, aisle_ids)
+            self.assertIn(department_id, department_ids)
+
+    def test_zip_target_keeps_existing_files(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            gen.generate(0.0001, 1, 'zip', 1, output_dir=output_dir)
+            self.assertEqual(sorted(os.listdir(output_dir)), sorted(f'{table}.csv.zip' for table in gen.TABLES))
+            with zipfile.ZipFile(os.path.join(output_dir, 'orders.csv.zip')) as archive:
+                header = archive.read('orders.csv').decode().splitlines()[0]
+            self.assertEqual(header, ','.join(gen.TABLES['orders']))
+
+            with self.assertRaises(FileExistsError):
+                gen.generate(0.0001, 1, 'zip', 1, output_dir=output_dir)
+            gen.generate(0.0001, 2, 'zip', 1, output_dir=output_dir, overwrite=True)
+            # The part files of the workers are removed
+            self.assertEqual(len(os.listdir(output_dir)), len(gen.TABLES))
+
+    def test_default_output_dir_is_not_the_kaggle_data(self):
+        self.assertEqual(gen.parse_args([]).output_dir, os.path.join('sample_data', 'synthetic'))
+
+
+if __name__ == '__main__':
+    unittest.main()
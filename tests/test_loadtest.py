@@ -0,0 +1,87 @@
+import json
+import os
+import random
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'dapr', 'python'))
+
+import loadtest
+from loadtest import PIPELINE_CALL_MIX, build_payload, compare, format_summary, percentile, summarise
+
+
+class TestLoadTest(unittest.TestCase):
+
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarise_per_method(self):
+        samples = [
+            ('audit-service', 'recordEvent', 200, 0.010),
+            ('audit-service', 'recordEvent', 500, 0.030),
+            ('lineage-service', 'getLineage', 200, 0.020),
+            ('lineage-service', 'getLineage', 'TimeoutError', 5.0),
+        ]
+        summary = summarise(samples, duration=2.0)
+
+        record = summary['audit-service/recordEvent']
+        self.assertEqual(record['requests'], 2)
+        self.assertEqual(record['errors'], 1)
+        self.assertAlmostEqual(record['throughput_rps'], 1.0)
+        self.assertAlmostEqual(record['p99_ms'], 30.0)
+        self.assertEqual(record['statuses'], {'200': 1, '500': 1})
+
+        self.assertEqual(summary['lineage-service/getLineage']['errors'], 1)
+        self.assertEqual(summary['ALL']['requests'], 4)
+        self.assertAlmostEqual(summary['ALL']['error_rate'], 0.5)
+
+    def test_compare_relative_change(self):
+        baseline = {'ALL': {'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 40.0, 'error_rate': 0.0, 'throughput_rps': 100.0}}
+        current = {'ALL': {'p50_ms': 15.0, 'p95_ms': 20.0, 'p99_ms': 20.0, 'error_rate': 0.1, 'throughput_rps': 50.0}}
+        deltas = compare(current, baseline)['ALL']
+        self.assertAlmostEqual(deltas['p50_ms'], 0.5)
+        self.assertAlmostEqual(deltas['p99_ms'], -0.5)
+        self.assertAlmostEqual(deltas['throughput_rps'], -0.5)
+        self.assertIsNone(deltas['error_rate'])
+
+    def test_payloads_match_app_calls(self):
+        rng = random.Random(0)
+        self.assertIn('dagId', build_payload('airflow-config-service', 'dagConfig', rng))
+        event = build_payload('audit-service', 'recordEvent', rng)
+        self.assertTrue({'status', 'dataset', 'correlationId'} <= set(event))
+        self.assertIsNone(build_payload('airflow-config-service', 'config', rng))
+
+    def test_format_summary_without_samples(self):
+        summary = summarise([], duration=2.0)
+        self.assertIsNone(summary['ALL']['p50_ms'])
+        self.assertIn('n/a', format_summary(summary).splitlines()[-1])
+
+    def test_call_mix_matches_pipeline(self):
+        self.assertNotIn('getEvents', [method for _, method, _, _ in PIPELINE_CALL_MIX])
+
+    def test_export_records_when_the_run_started(self):
+        run_started = []
+
+        def run(coroutine):
+            coroutine.close()
+            run_started.append(datetime.now())
+            return [('audit-service', 'recordEvent', 200, 0.010)], 1.0
+
+        with tempfile.TemporaryDirectory() as output_dir, mock.patch.object(loadtest.asyncio, 'run', run):
+            path = os.path.join(output_dir, 'results.json')
+            loadtest.main(['--output', path])
+            with open(path) as handle:
+                started_at = datetime.fromisoformat(json.load(handle)['metadata']['started_at'])
+        self.assertLessEqual(started_at, run_started[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import sys
+import tempfile
+import unittest
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow', 'plugins'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'dapr', 'python'))
+
+import exports
+import parquet_export
+
+Column = namedtuple('Column', 'name type_code')
+
+
+class FakeNamedCursor:
+    """Serves rows in batches and, like a psycopg2 named cursor, only has a description after a fetch."""
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = list(rows)
+        self.description = None
+        self.fetch_sizes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        self.query = query
+
+    def fetchmany(self, size):
+        self.description = self.columns
+        self.fetch_sizes.append(size)
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+class FakeConnection:
+
+    def __init__(self, cursor):
+        self.named_cursor = cursor
+        self.cursor_names = []
+
+    def cursor(self, name=None):
+        self.cursor_names.append(name)
+        return self.named_cursor
+
+
+DAILY_COLUMNS = [Column('dt', 1082), Column('daily_orders_count', 20), Column('rolling_7_day_avg', 1700),
+                 Column('__partition', 25)]
+DAILY_ROWS = [(date(2019, 1, 30), 10, Decimal('9.5'), '2019-01'),
+              (date(2019, 1, 31), 12, Decimal('10.25'), '2019-01'),
+              (date(2019, 2, 1), 8, None, '2019-02')]
+
+
+class TestParquetExport(unittest.TestCase):
+
+    def setUp(self):
+        self.export_dir = tempfile.mkdtemp()
+
+    def test_unpartitioned_export(self):
+        cursor = FakeNamedCursor([Column('aisle', 1043), Column('number_of_orders', 20)],
+                                 [('fresh fruits', 300), ('fresh vegetables', 200), ('yogurt', 100)])
+        target = os.path.join(self.export_dir, 'top_selling_aisles')
+        rows = parquet_export.export_query(FakeConnection(cursor), 'select', target, batch_size=2, cursor_name='export_x')
+        self.assertEqual(rows, 3)
+        self.assertEqual(cursor.fetch_sizes, [2, 2, 2])
+        table = pq.read_table(target, memory_map=True)
+        self.assertEqual(table.column('aisle').to_pylist(), ['fresh fruits', 'fresh vegetables', 'yogurt'])
+        self.assertEqual(pq.ParquetFile(os.path.join(target, 'part-0.parquet')).metadata.row_group(0).column(0).compression,
+                         'ZSTD')
+
+    def test_empty_export_keeps_schema(self):
+        cursor = FakeNamedCursor([Column('order_dow', 23), Column('avg_product_count', 1700)], [])
+        target = os.path.join(self.export_dir, 'avg_product_count_by_dow')
+        self.assertEqual(parquet_export.export_query(FakeConnection(cursor), 'select', target), 0)
+        table = pq.read_table(target)
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.schema.names, ['order_dow', 'avg_product_count'])
+
+    def test_partitioned_export(self):
+        target = os.path.join(self.export_dir, 'daily_orders_7_day_avg')
+        rows = parquet_export.export_query(FakeConnection(FakeNamedCursor(DAILY_COLUMNS, DAILY_ROWS)), 'select',
+                                           target, partition_name='month', batch_size=2)
+        self.assertEqual(rows, 3)
+        self.assertEqual(sorted(os.listdir(target)), ['month=2019-01', 'month=2019-02'])
+        table = pq.read_table(target, partitioning='hive').sort_by('dt')
+        self.assertEqual(table.column('rolling_7_day_avg').to_pylist(), [9.5, 10.25, None])
+        self.assertEqual(table.column('dt').to_pylist()[0], date(2019, 1, 30))
+        self.assertEqual([str(month) for month in table.column('month').to_pylist()], ['2019-01', '2019-01', '2019-02'])
+
+        manifest = parquet_export.write_export_manifest(target, 'daily_orders_7_day_avg', 'build-1', 'month')
+        self.assertEqual(manifest['rows'], 3)
+        self.assertEqual(manifest['partitions'], ['month=2019-01', 'month=2019-02'])
+        self.assertEqual(parquet_export.read_export_manifest(target), manifest)
+
+    def test_app_reads_export(self):
+        target = os.path.join(self.export_dir, 'daily_orders_7_day_avg')
+        self.assertIsNone(exports.export_mtime('daily_orders_7_day_avg', self.export_dir))
+        parquet_export.export_query(FakeConnection(FakeNamedCursor(DAILY_COLUMNS, DAILY_ROWS)), 'select',
+                                    target, partition_name='month')
+        parquet_export.write_export_manifest(target, 'daily_orders_7_day_avg', 'build-1', 'month')
+        self.assertIsNotNone(exports.export_mtime('daily_orders_7_day_avg', self.export_dir))
+        self.assertEqual(exports.read_manifest('daily_orders_7_day_avg', self.export_dir)['rows'], 3)
+        table = exports.read_export('daily_orders_7_day_avg', self.export_dir, filters=[('month', '=', '2019-02')])
+        self.assertEqual(table.column('daily_orders_count').to_pylist(), [8])
+
+    def test_replace_dir(self):
+        target = os.path.join(self.export_dir, 'model')
+        for content in ('old', 'new'):
+            staging = os.path.join(self.export_dir, f'.staging-{content}')
+            os.makedirs(staging)
+            with open(os.path.join(staging, 'part-0.parquet'), 'w') as handle:
+                handle.write(content)
+            parquet_export.replace_dir(staging, target)
+        with open(os.path.join(target, 'part-0.parquet')) as handle:
+            self.assertEqual(handle.read(), 'new')
+        self.assertEqual(os.listdir(self.export_dir), ['model'])
+
+
+if __name__ == '__main__':
+    unittest.main()
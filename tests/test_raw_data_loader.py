@@ -0,0 +1,127 @@
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow', 'plugins'))
+
+import raw_data_loader
+
+HEADER = b'order_id,user_id,eval_set,order_number,order_dow,order_hour_of_day,days_since_prior_order\n'
+FIRST = b'1,10,prior,1,2,8,\n2,10,prior,2,3,7,15.0\n'
+TAIL = b'3,11,prior,1,4,12,\n'
+
+
+class FakeCursor:
+    """Records executed statements and the content sent to COPY FROM STDIN."""
+
+    def __init__(self):
+        self.statements = []
+        self.copied = []
+
+    def execute(self, query, params=None):
+        self.statements.append(repr(query))
+
+    def copy_expert(self, query, stream):
+        self.statements.append(repr(query))
+        self.copied.append(stream.read())
+
+
+class TestRawDataLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+
+    def write_csv(self, content, table='orders', zipped=False):
+        path = os.path.join(self.data_dir, f'{table}.csv')
+        if zipped:
+            path += '.zip'
+            with zipfile.ZipFile(path, 'w') as archive:
+                archive.writestr(f'{table}.csv', content)
+        else:
+            with open(path, 'wb') as handle:
+                handle.write(content)
+        return path
+
+    def loaded_state(self, content):
+        return {'sha256': hashlib.sha256(content).hexdigest(), 'bytes': len(content), 'rows': content.count(b'\n') - 1}
+
+    def test_scan_plain_and_zipped(self):
+        for zipped in (False, True):
+            path = self.write_csv(HEADER + FIRST + TAIL, zipped=zipped)
+            self.assertEqual(raw_data_loader.source_path('orders', self.data_dir), path)
+            scanned = raw_data_loader.scan(path, prefix_bytes=len(HEADER + FIRST), chunk_size=7)
+            self.assertEqual(scanned['sha256'], hashlib.sha256(HEADER + FIRST + TAIL).hexdigest())
+            self.assertEqual(scanned['bytes'], len(HEADER + FIRST + TAIL))
+            self.assertEqual(scanned['rows'], 3)
+            self.assertEqual(scanned['prefix_sha256'], hashlib.sha256(HEADER + FIRST).hexdigest())
+            self.assertTrue(scanned['prefix_at_line_end'])
+            os.remove(path)
+
+    def test_scan_without_trailing_newline(self):
+        path = self.write_csv(HEADER + FIRST + TAIL.rstrip(b'\n'))
+        scanned = raw_data_loader.scan(path, prefix_bytes=len(HEADER) + 3)
+        self.assertEqual(scanned['rows'], 3)
+        self.assertFalse(scanned['prefix_at_line_end'])
+
+    def test_missing_file(self):
+        with self.assertRaises(FileNotFoundError):
+            raw_data_loader.source_path('aisles', self.data_dir)
+
+    def test_plan_load(self):
+        state = self.loaded_state(HEADER + FIRST)
+        path = self.write_csv(HEADER + FIRST)
+        unchanged = raw_data_loader.scan(path, prefix_bytes=state['bytes'])
+        self.assertEqual(raw_data_loader.plan_load(None, unchanged, True), 'full')
+        self.assertEqual(raw_data_loader.plan_load(state, unchanged, True), 'skip')
+        self.assertEqual(raw_data_loader.plan_load(state, unchanged, True, table_exists=False), 'full')
+
+        path = self.write_csv(HEADER + FIRST + TAIL)
+        grown = raw_data_loader.scan(path, prefix_bytes=state['bytes'])
+        self.assertEqual(raw_data_loader.plan_load(state, grown, True), 'append')
+        self.assertEqual(raw_data_loader.plan_load(state, grown, False), 'full')
+
+        # Rows changed in the already loaded part: the tail alone would be wrong
+        path = self.write_csv(HEADER + FIRST.replace(b'prior', b'train', 1) + TAIL)
+        rewritten = raw_data_loader.scan(path, prefix_bytes=state['bytes'])
+        self.assertEqual(raw_data_loader.plan_load(state, rewritten, True), 'full')
+
+        # The last loaded row was completed rather than followed by new rows
+        partial = self.loaded_state(HEADER + FIRST[:-1])
+        path = self.write_csv(HEADER + FIRST + TAIL)
+        self.assertEqual(raw_data_loader.plan_load(partial, raw_data_loader.scan(path, partial['bytes']), True), 'full')
+
+    def test_load_appends_the_tail_only(self):
+        state = self.loaded_state(HEADER + FIRST)
+        path = self.write_csv(HEADER + FIRST + TAIL, zipped=True)
+        scanned = raw_data_loader.scan(path, prefix_bytes=state['bytes'])
+        cursor = FakeCursor()
+        raw_data_loader.load(cursor, 'orders', path, state, scanned, 'append', os.stat(path))
+        self.assertEqual(cursor.copied, [TAIL])
+        self.assertFalse(any('drop table' in statement for statement in cursor.statements))
+
+    def test_full_load_drops_its_own_table(self):
+        path = self.write_csv(b'product_id,product_name,aisle_id,department_id\n1,Chocolate Sandwich Cookies,61,19\n',
+                              table='products')
+        scanned = raw_data_loader.scan(path)
+        cursor = FakeCursor()
+        raw_data_loader.load(cursor, 'products', path, None, scanned, 'full', os.stat(path))
+        drop = next(statement for statement in cursor.statements if 'drop table' in statement)
+        self.assertIn("Identifier('dbt_raw_data'), SQL('.'), Identifier('products')", drop)
+        self.assertEqual(len(cursor.copied), 1)
+        self.assertIn('Chocolate Sandwich Cookies', cursor.copied[0].decode())
+
+    def test_file_unchanged(self):
+        path = self.write_csv(HEADER + FIRST)
+        stat = os.stat(path)
+        state = dict(self.loaded_state(HEADER + FIRST), file_bytes=stat.st_size, file_mtime=stat.st_mtime)
+        self.assertTrue(raw_data_loader.file_unchanged(state, stat))
+        self.assertFalse(raw_data_loader.file_unchanged(None, stat))
+        os.utime(path, (stat.st_atime, stat.st_mtime + 60))
+        self.assertFalse(raw_data_loader.file_unchanged(state, os.stat(path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
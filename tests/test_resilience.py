@@ -0,0 +1,213 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'dapr', 'python'))
+
+from resilience import CircuitBreaker, HedgePool, call_with_budget, hedged
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('svc', failure_threshold=3, reset_timeout=30, clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.record_success()
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.retry_after(), 30)
+
+    def test_half_open_probe(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now = 30
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+
+        # A failed probe opens the circuit again for another reset_timeout
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.now = 59
+        self.assertFalse(self.breaker.allow_request())
+
+        self.clock.now = 60
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow_request())
+
+
+class TestCallWithBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def call(self, fn, **kwargs):
+        return call_with_budget(fn, budget=5, attempt_timeout=2, clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_retries_until_success(self):
+        timeouts = []
+
+        def fn(timeout):
+            timeouts.append(timeout)
+            if len(timeouts) < 3:
+                raise ConnectionError('down')
+            return 'ok'
+
+        self.assertEqual(self.call(fn), 'ok')
+        self.assertEqual(timeouts, [2, 2, 2])
+
+    def test_attempts_are_bounded_by_the_budget(self):
+        timeouts = []
+
+        def fn(timeout):
+            timeouts.append(timeout)
+            self.clock.now += timeout
+            raise TimeoutError('slow')
+
+        with self.assertRaises(TimeoutError):
+            self.call(fn, max_attempts=5)
+        self.assertLessEqual(self.clock.now, 5)
+        self.assertLess(timeouts[-1], 2)
+
+    def test_non_retryable_errors_are_raised(self):
+        calls = []
+
+        def fn(timeout):
+            calls.append(timeout)
+            raise ValueError('bad request')
+
+        with self.assertRaises(ValueError):
+            self.call(fn, retryable=lambda e: not isinstance(e, ValueError))
+        self.assertEqual(len(calls), 1)
+
+
+class TestHedged(unittest.TestCase):
+
+    def test_second_request_wins_when_first_is_slow(self):
+        calls = []
+        lock = threading.Lock()
+
+        def fn(timeout):
+            with lock:
+                calls.append(timeout)
+                first = len(calls) == 1
+            if first:
+                time.sleep(0.5)
+                return 'slow'
+            return 'fast'
+
+        started = time.monotonic()
+        self.assertEqual(hedged(fn, delay=0.05)(2), 'fast')
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(len(calls), 2)
+
+    def test_no_hedge_when_first_is_fast(self):
+        calls = []
+
+        def fn(timeout):
+            calls.append(timeout)
+            return 'ok'
+
+        self.assertEqual(hedged(fn, delay=0.5)(2), 'ok')
+        self.assertEqual(len(calls), 1)
+
+    def test_raises_when_all_requests_fail(self):
+        def fn(timeout):
+            time.sleep(0.1)
+            raise ConnectionError('down')
+
+        with self.assertRaises(ConnectionError):
+            hedged(fn, delay=0.01)(2)
+
+    def test_waits_no_longer_than_the_timeout(self):
+        def fn(timeout):
+            time.sleep(1)
+            return 'late'
+
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            hedged(fn, delay=0.05, pool=HedgePool(4))(0.2)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_disabled(self):
+        fn = lambda timeout: 'ok'
+        self.assertIs(hedged(fn, delay=None), fn)
+
+    def test_no_queueing_when_the_pool_is_busy(self):
+        pool = HedgePool(1)
+        release = threading.Event()
+        busy = pool.try_submit(release.wait)
+        self.assertIsNone(pool.try_submit(release.wait))
+        threads = []
+
+        def fn(timeout):
+            threads.append(threading.current_thread())
+            time.sleep(0.1)
+            return 'ok'
+
+        # Runs on the calling thread right away, without a hedge
+        self.assertEqual(hedged(fn, delay=0.01, pool=pool)(2), 'ok')
+        self.assertEqual(threads, [threading.current_thread()])
+        release.set()
+        busy.result()
+        self.assertIsNotNone(pool.try_submit(lambda: None))
+
+    def test_no_hedge_without_a_free_thread(self):
+        calls = []
+
+        def fn(timeout):
+            calls.append(timeout)
+            time.sleep(0.2)
+            return 'ok'
+
+        self.assertEqual(hedged(fn, delay=0.01, pool=HedgePool(1))(2), 'ok')
+        self.assertEqual(len(calls), 1)
+
+    def test_no_duplicates_under_batch_load(self):
+        # 16 pipeline threads share a smaller pool: requests that find no free thread are not hedged either
+        requests = []
+        lock = threading.Lock()
+
+        def fn(timeout):
+            with lock:
+                requests.append(timeout)
+            time.sleep(0.1)
+            return 'ok'
+
+        pool = HedgePool(4)
+        threads = [threading.Thread(target=lambda: [hedged(fn, delay=0.15, pool=pool)(2) for _ in range(2)])
+                   for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(requests), 32)
+
+
+if __name__ == '__main__':
+    unittest.main()